@@ -1,3 +1,3 @@
-__all__ = ["PoeBot", "run"]
+__all__ = ["BotMount", "PoeBot", "make_app", "make_multi_bot_app", "run"]
 
-from .base import PoeBot, run
+from .base import BotMount, PoeBot, make_app, make_multi_bot_app, run
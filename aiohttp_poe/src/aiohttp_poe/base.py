@@ -2,10 +2,13 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import contextlib
 import json
+import multiprocessing
 import os
 import sys
-from typing import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Sequence
 
 from aiohttp import web
 from aiohttp_sse import EventSourceResponse, sse_response
@@ -21,6 +24,11 @@ from .types import (
 )
 
 
+def _is_disconnected(request: web.Request) -> bool:
+    transport = request.transport
+    return transport is None or transport.is_closing()
+
+
 # We need to override this to allow POST requests to use SSE
 class _SSEResponse(EventSourceResponse):
     async def prepare(self, request: web.Request):
@@ -31,42 +39,20 @@ class _SSEResponse(EventSourceResponse):
             # usually not known beforehand.
             self.enable_chunked_encoding()
             return writer
-        else:
-            # hackish way to check if connection alive
-            # should be updated once we have proper API in aiohttp
-            # https://github.com/aio-libs/aiohttp/issues/3105
-            if request.protocol.transport is None:
-                # request disconnected
-                raise asyncio.CancelledError()
-
-
-async def authenticate(request: web.Request, token: str) -> bool:
-    if auth_key is not None and token != auth_key:
-        return False
-    return True
-
-
-@web.middleware
-async def auth_middleware(request: web.Request, handler):
-    auth_header = request.headers.get("Authorization")
-    if auth_header:
-        scheme, _, token = auth_header.partition(" ")
-        if scheme.lower() == "bearer":
-            is_authenticated = await authenticate(request, token)
-            if is_authenticated:
-                return await handler(request)
-    return web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+        elif _is_disconnected(request):
+            raise asyncio.CancelledError()
 
 
 class PoeBot:
-    async def __call__(self, request: web.Request) -> web.Response:
+    # get_response runs at most this many events ahead of what has been sent to the
+    # client, so slow readers apply backpressure instead of growing a buffer.
+    max_buffered_events = 32
+
+    async def __call__(self, request: web.Request) -> web.StreamResponse:
         body = await request.json()
         request_type = body["type"]
         if request_type == "query":
-            await self.__handle_query(body, request)
-            # Apparently aiohttp's types don't work well with whatever aiohttp_sse
-            # is doing to create a streaming response.
-            return None  # type: ignore
+            return await self.__handle_query(body, request)
         elif request_type == "settings":
             settings = await self.get_settings()
             return web.Response(
@@ -83,11 +69,54 @@ class PoeBot:
                 status=501, text="Unsupported request type", reason="Not Implemented"
             )
 
-    async def __handle_query(self, query: QueryRequest, request: web.Request) -> None:
-        async with sse_response(request, response_cls=_SSEResponse) as resp:
-            async for event_type, data in self.get_response(query, request):
-                await resp.send(json.dumps(data), event=event_type)
-            await resp.send("{}", event="done")
+    async def __produce_events(
+        self,
+        query: QueryRequest,
+        request: web.Request,
+        queue: asyncio.Queue[Event | Exception | None],
+    ) -> None:
+        try:
+            async for event in self.get_response(query, request):
+                await queue.put(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Re-raised by the task that sends the response
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    async def __handle_query(
+        self, query: QueryRequest, request: web.Request
+    ) -> web.StreamResponse:
+        # get_response runs in its own task so that it can be cancelled as soon as
+        # the client goes away, wherever it is currently waiting. aiohttp cancels
+        # this handler when that happens (see handler_cancellation in _serve()).
+        queue: asyncio.Queue[Event | Exception | None] = asyncio.Queue(
+            maxsize=self.max_buffered_events
+        )
+        producer = asyncio.ensure_future(self.__produce_events(query, request, queue))
+        try:
+            async with sse_response(request, response_cls=_SSEResponse) as resp:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    event_type, data = item
+                    await resp.send(json.dumps(data), event=event_type)
+                await resp.send("{}", event="done")
+            return resp
+        except (asyncio.CancelledError, ConnectionResetError):
+            producer.cancel()
+            # Let get_response finish cleaning up before the hook runs
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+            await self.on_cancel(query, request)
+            raise
+        finally:
+            producer.cancel()
 
     @staticmethod
     def text_event(text: str) -> Event:
@@ -142,6 +171,15 @@ class PoeBot:
         """Called when we receive user feedback such as likes."""
         pass
 
+    async def on_cancel(self, query: QueryRequest, request: web.Request) -> None:
+        """Called when a query is abandoned before it finishes.
+
+        This happens when the client disconnects. get_response has already been
+        cancelled when this is called.
+
+        """
+        pass
+
     async def get_settings(self) -> SettingsResponse:
         """Return the settings for this bot."""
         return {}
@@ -179,20 +217,163 @@ def find_auth_key(api_key: str, *, allow_without_key: bool = False) -> str | Non
     return api_key
 
 
-def run(
-    bot: Callable[[web.Request], Awaitable[web.Response]],
-    api_key: str = "",
-    *,
-    allow_without_key: bool = False,
-) -> None:
+BotHandler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+@dataclass
+class BotMount:
+    """A bot served by make_multi_bot_app().
+
+    Requests are routed to the bot by URL *path* and, if *host* is set, by the Host
+    header. *api_key* and *allow_without_key* are as for run(), but apply to this
+    bot only.
+
+    """
+
+    bot: BotHandler
+    api_key: str = ""
+    path: str = "/"
+    host: str | None = None
+    allow_without_key: bool = False
+
+
+def _normalize_path(path: str) -> str:
+    return "/" + path.strip("/")
+
+
+def _is_authorized(request: web.Request, auth_key: str | None) -> bool:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    return auth_key is None or token == auth_key
+
+
+def make_multi_bot_app(bots: Sequence[BotMount]) -> web.Application:
+    """Create an app that serves several bots, each with its own API key.
+
+    All bots share one process and event loop. Each request is routed with a single
+    dictionary lookup on its host and path; mounts without a host match any host.
+
+    """
+    routes: dict[tuple[str | None, str], tuple[BotHandler, str | None]] = {}
+    for mount in bots:
+        host = mount.host.lower() if mount.host is not None else None
+        route = (host, _normalize_path(mount.path))
+        if route in routes:
+            raise ValueError(f"More than one bot is mounted at {route}")
+        auth_key = find_auth_key(
+            mount.api_key, allow_without_key=mount.allow_without_key
+        )
+        routes[route] = (mount.bot, auth_key)
+
+    async def handle_post(request: web.Request) -> web.StreamResponse:
+        path = _normalize_path(request.path)
+        host = request.host.split(":")[0].lower()
+        route = routes.get((host, path)) or routes.get((None, path))
+        if route is None:
+            raise web.HTTPNotFound()
+        bot, auth_key = route
+        if not _is_authorized(request, auth_key):
+            raise web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+        return await bot(request)
+
+    app = web.Application()
+    app.add_routes([web.get("/", index), web.post("/{path:.*}", handle_post)])
+    return app
+
+
+def make_app(
+    bot: BotHandler, api_key: str = "", *, allow_without_key: bool = False
+) -> web.Application:
+    """Create an app object. Arguments are as for run()."""
+    return make_multi_bot_app(
+        [BotMount(bot, api_key=api_key, allow_without_key=allow_without_key)]
+    )
+
+
+def _make_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser("aiohttp sample Poe bot server")
     parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes sharing the port (requires fork)",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=["asyncio", "uvloop"],
+        default="asyncio",
+        help="Event loop implementation (uvloop requires the aiohttp_poe[uvloop] extra)",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=2048,
+        help="Maximum number of pending connections",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=float,
+        default=75.0,
+        help="Close idle keep-alive connections after this many seconds",
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=60.0,
+        help="On shutdown, wait this many seconds for in-flight responses to finish",
+    )
+    return parser
+
+
+def _serve(app: web.Application, args: argparse.Namespace) -> None:
+    if args.loop == "uvloop":
+        try:
+            import uvloop  # type: ignore[import]
+        except ImportError:
+            raise SystemExit(
+                "--loop uvloop requires uvloop; install aiohttp_poe[uvloop]"
+            ) from None
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    web.run_app(
+        app,
+        host=args.host,
+        port=args.port,
+        backlog=args.backlog,
+        keepalive_timeout=args.keepalive_timeout,
+        shutdown_timeout=args.shutdown_timeout,
+        # Cancel handlers when the client disconnects, so get_response stops too
+        handler_cancellation=True,
+        # Lets several worker processes listen on the same port
+        reuse_port=args.workers > 1,
+    )
+
+
+def run(bot: BotHandler, api_key: str = "", *, allow_without_key: bool = False) -> None:
+    parser = _make_parser()
     args = parser.parse_args()
 
-    global auth_key
-    auth_key = find_auth_key(api_key, allow_without_key=allow_without_key)
+    app = make_app(bot, api_key, allow_without_key=allow_without_key)
+    if args.workers == 1:
+        _serve(app, args)
+        return
 
-    app = web.Application(middlewares=[auth_middleware])
-    app.add_routes([web.get("/", index)])
-    app.add_routes([web.post("/", bot)])
-    web.run_app(app, port=args.port)
+    # Workers are forked so they inherit the bot object without pickling it
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        parser.error("--workers is not supported on this platform")
+    workers = [
+        context.Process(target=_serve, args=(app, args)) for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # The workers receive the signal too and shut down gracefully
+        for worker in workers:
+            worker.join()
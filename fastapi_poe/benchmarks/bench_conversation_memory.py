@@ -0,0 +1,67 @@
+"""
+
+Benchmark for the memory used by parsed conversations.
+
+Measures, with tracemalloc, the memory held by a parsed query request with a list of
+ProtocolMessages and with a CompactConversation (PoeBot.compact_conversations), for
+conversations of 10, 100 and 1000 messages. The decoded request body is not counted;
+its message contents are shared by both representations.
+
+Run with: python benchmarks/bench_conversation_memory.py
+
+"""
+import json
+import tracemalloc
+from typing import Any, Dict
+
+from fastapi_poe.parsing import decode_request, parse_query_request
+
+
+def _make_request(num_messages: int) -> Dict[str, Any]:
+    query = [
+        {
+            "role": "user" if i % 2 == 0 else "bot",
+            "content": f"message {i} " * 20,
+            "content_type": "text/markdown",
+            "timestamp": 1_690_000_000_000_000 + i,
+            "message_id": f"m-{i}",
+            "feedback": [],
+        }
+        for i in range(num_messages)
+    ]
+    body = json.dumps(
+        {
+            "version": "1.0",
+            "type": "query",
+            "query": query,
+            "user_id": "u-1",
+            "conversation_id": "c-1",
+            "message_id": "m-final",
+        }
+    )
+    return decode_request(body.encode("utf-8"))
+
+
+def _retained_bytes(data: Dict[str, Any], compact: bool) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    request = parse_query_request(data, "<missing>", compact=compact)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del request
+    return after - before
+
+
+def main() -> None:
+    for num_messages in (10, 100, 1000):
+        data = _make_request(num_messages)
+        models = _retained_bytes(data, compact=False)
+        compact = _retained_bytes(data, compact=True)
+        print(
+            f"{num_messages:>5} messages: ProtocolMessage {models / 1024:,.1f} KiB,"
+            f" compact {compact / 1024:,.1f} KiB ({models / compact:.1f}x smaller)"
+        )
+
+
+if __name__ == "__main__":
+    main()
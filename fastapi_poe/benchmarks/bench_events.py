@@ -0,0 +1,51 @@
+"""
+
+Benchmark for encoding server-sent events.
+
+Compares building and encoding text events through PoeBot.text_event() with the
+previous path of json.dumps() plus ServerSentEvent.encode(), in events per second.
+
+Run with: python benchmarks/bench_events.py
+
+"""
+import argparse
+import json
+import time
+from typing import Callable
+
+from sse_starlette.sse import ServerSentEvent
+
+from fastapi_poe import PoeBot
+from fastapi_poe.events import orjson
+
+
+def _legacy_text_event(text: str) -> bytes:
+    return ServerSentEvent(data=json.dumps({"text": text}), event="text").encode()
+
+
+def _fast_text_event(text: str) -> bytes:
+    return PoeBot.text_event(text).encode()
+
+
+def _events_per_sec(encode: Callable[[str], bytes], num_events: int) -> float:
+    tokens = [f" token{i}" for i in range(num_events)]
+    start = time.perf_counter()
+    for token in tokens:
+        encode(token)
+    return num_events / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("SSE encoding benchmark")
+    parser.add_argument("--events", type=int, default=200_000)
+    args = parser.parse_args()
+
+    legacy = _events_per_sec(_legacy_text_event, args.events)
+    fast = _events_per_sec(_fast_text_event, args.events)
+    print(f"json encoder: {'orjson' if orjson is not None else 'json'}")
+    print(f"legacy: {legacy:,.0f} events/sec")
+    print(f"fast:   {fast:,.0f} events/sec ({fast / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+
+Benchmark for parsing query requests.
+
+Compares decode_request() plus parse_query_request() with the previous path of
+json.loads() plus QueryRequest.parse_obj(), for conversations of 10, 100 and 1000
+messages, in microseconds per request.
+
+Run with: python benchmarks/bench_parse_request.py
+
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable
+
+from fastapi_poe.events import orjson
+from fastapi_poe.parsing import decode_request, parse_query_request
+from fastapi_poe.types import QueryRequest
+
+
+def _make_body(num_messages: int) -> bytes:
+    query = [
+        {
+            "role": "user" if i % 2 == 0 else "bot",
+            "content": f"message {i} " * 20,
+            "content_type": "text/markdown",
+            "timestamp": 1_690_000_000_000_000 + i,
+            "message_id": f"m-{i}",
+            "feedback": [],
+        }
+        for i in range(num_messages)
+    ]
+    request = {
+        "version": "1.0",
+        "type": "query",
+        "query": query,
+        "user_id": "u-1",
+        "conversation_id": "c-1",
+        "message_id": "m-final",
+    }
+    return json.dumps(request).encode("utf-8")
+
+
+def _legacy_parse(body: bytes) -> Any:
+    request = json.loads(body)
+    return QueryRequest.parse_obj({**request, "api_key": "<missing>"})
+
+
+def _fast_parse(body: bytes) -> Any:
+    return parse_query_request(decode_request(body), "<missing>")
+
+
+def _usecs_per_request(
+    parse: Callable[[bytes], Any], body: bytes, rounds: int
+) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parse(body)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("Query request parsing benchmark")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"json decoder: {'orjson' if orjson is not None else 'json'}")
+    for num_messages in (10, 100, 1000):
+        body = _make_body(num_messages)
+        assert _legacy_parse(body) == _fast_parse(body)
+        rounds = max(1, args.rounds * 100 // num_messages)
+        legacy = _usecs_per_request(_legacy_parse, body, rounds)
+        fast = _usecs_per_request(_fast_parse, body, rounds)
+        print(
+            f"{num_messages:>5} messages: legacy {legacy:,.0f} us,"
+            f" fast {fast:,.0f} us ({legacy / fast:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
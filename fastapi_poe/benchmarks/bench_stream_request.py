@@ -0,0 +1,75 @@
+"""
+
+Micro-benchmark for the client side of stream_request.
+
+Streams a response of 1,000 events from a local stub transport (no network) and
+reports the average cost per event, so regressions in event handling show up.
+
+Run with: python benchmarks/bench_stream_request.py
+
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from fastapi_poe.client import MAX_EVENT_COUNT, stream_request
+from fastapi_poe.types import ProtocolMessage, QueryRequest
+
+
+def _make_sse_body(num_events: int, chunk: str) -> bytes:
+    frame = f"event: text\r\ndata: {json.dumps({'text': chunk})}\r\n\r\n"
+    return (frame * (num_events - 1) + "event: done\r\ndata: {}\r\n\r\n").encode()
+
+
+def _make_request(num_messages: int) -> QueryRequest:
+    return QueryRequest(
+        version="1.0",
+        type="query",
+        query=[
+            ProtocolMessage(role="user" if i % 2 == 0 else "bot", content="x" * 200)
+            for i in range(num_messages)
+        ],
+        user_id="u-1",
+        conversation_id="c-1",
+        message_id="m-1",
+    )
+
+
+async def _bench(num_events: int, num_messages: int, rounds: int) -> float:
+    body = _make_sse_body(num_events, chunk="y" * 10)
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(
+            200, content=body, headers={"Content-Type": "text/event-stream"}
+        )
+    )
+    request = _make_request(num_messages)
+    async with httpx.AsyncClient(transport=transport) as session:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            async for _message in stream_request(
+                request, "StubBot", "key", session=session, base_url="http://stub/"
+            ):
+                pass
+        elapsed = time.perf_counter() - start
+    return elapsed / (rounds * num_events)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("stream_request micro-benchmark")
+    parser.add_argument("--events", type=int, default=MAX_EVENT_COUNT)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    per_event = asyncio.run(_bench(args.events, args.messages, args.rounds))
+    print(
+        f"{args.events} events x {args.rounds} rounds, {args.messages} messages of"
+        f" context: {per_event * 1e6:.2f} us/event"
+    )
+
+
+if __name__ == "__main__":
+    main()
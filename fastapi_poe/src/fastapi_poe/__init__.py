@@ -1,3 +1,3 @@
-__all__ = ["PoeBot", "run", "make_app"]
+__all__ = ["BotMount", "PoeBot", "run", "run_app", "make_app", "make_multi_bot_app"]
 
-from .base import PoeBot, make_app, run
+from .base import BotMount, PoeBot, make_app, make_multi_bot_app, run, run_app
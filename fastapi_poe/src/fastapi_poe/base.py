@@ -1,18 +1,33 @@
 import argparse
+import asyncio
+import contextlib
 import copy
-import json
+import functools
 import logging
 import os
 import sys
-from typing import Any, AsyncIterable, Dict, Optional, Union
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Dict, List, Optional, Sequence, Tuple, Union
 
+import anyio
 from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sse_starlette.sse import EventSourceResponse, ServerSentEvent
-from starlette.middleware.base import BaseHTTPMiddleware
 
+from fastapi_poe.client import (
+    close_shared_session,
+    enable_metrics as enable_client_metrics,
+    get_shared_session,
+)
+from fastapi_poe.concurrency import LoopLagMonitor
+from fastapi_poe.events import EncodedEvent, TextEvent, dumps
+from fastapi_poe.metrics import REGISTRY, BotMetrics, track_request
+from fastapi_poe.middleware import LoggingMiddleware  # noqa: F401
+from fastapi_poe.parsing import decode_request, parse_query_request, validate
+from fastapi_poe.resources import ResourceRegistry
 from fastapi_poe.types import (
     ContentType,
     QueryRequest,
@@ -25,48 +40,16 @@ from fastapi_poe.types import (
 logger = logging.getLogger("uvicorn.default")
 
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def set_body(self, request: Request):
-        receive_ = await request._receive()
-
-        async def receive():
-            return receive_
-
-        request._receive = receive
-
-    async def dispatch(self, request: Request, call_next):
-        logger.info(f"Request: {request.method} {request.url}")
-        try:
-            # Per https://github.com/tiangolo/fastapi/issues/394#issuecomment-927272627
-            # to avoid blocking.
-            await self.set_body(request)
-            body = await request.json()
-            logger.debug(f"Request body: {json.dumps(body)}")
-        except json.JSONDecodeError:
-            logger.error("Request body: Unable to parse JSON")
-
-        response = await call_next(request)
-
-        logger.info(f"Response status: {response.status_code}")
-        try:
-            if hasattr(response, "body"):
-                body = json.loads(response.body.decode())
-                logger.debug(f"Response body: {json.dumps(body)}")
-        except json.JSONDecodeError:
-            logger.error("Response body: Unable to parse JSON")
-
-        return response
-
-
-def exception_handler(request: Request, ex: HTTPException):
+async def exception_handler(request: Request, ex: RequestValidationError) -> Response:
     logger.error(ex)
+    return await request_validation_exception_handler(request, ex)
 
 
 http_bearer = HTTPBearer()
 
 
-def auth_user(
-    authorization: HTTPAuthorizationCredentials = Depends(http_bearer),
+def check_auth(
+    authorization: HTTPAuthorizationCredentials, auth_key: Optional[str]
 ) -> None:
     if auth_key is None:
         return
@@ -78,7 +61,55 @@ def auth_user(
         )
 
 
+# Events that never change are encoded only once
+_DONE_EVENT = EncodedEvent("done", b"{}")
+
+
+@functools.lru_cache(maxsize=None)
+def _make_meta_event(
+    content_type: ContentType,
+    refetch_settings: bool,
+    linkify: bool,
+    suggested_replies: bool,
+) -> ServerSentEvent:
+    return EncodedEvent(
+        "meta",
+        dumps(
+            {
+                "content_type": content_type,
+                "refetch_settings": refetch_settings,
+                "linkify": linkify,
+                "suggested_replies": suggested_replies,
+            }
+        ),
+    )
+
+
 class PoeBot:
+    # Set coalesce_text_events to True to batch consecutive text events into a single
+    # event. Buffered text is sent once it is coalesce_window_secs old, once it reaches
+    # coalesce_max_bytes, or when the bot sends another kind of event. The first text
+    # event is always sent immediately. Only events created with text_event() are
+    # merged.
+    coalesce_text_events: bool = False
+    coalesce_window_secs: float = 0.05
+    coalesce_max_bytes: int = 4096
+
+    # get_response runs at most this many events ahead of what has been sent to the
+    # client, so slow readers apply backpressure instead of growing a buffer.
+    max_buffered_events: int = 32
+    # If set, the response is aborted when sending one event to the client takes
+    # longer than this.
+    send_timeout_secs: Optional[float] = None
+
+    # Set compact_conversations to True to receive query.query as a read-only
+    # CompactConversation instead of a list of ProtocolMessages. The messages have the
+    # same attributes but use much less memory for long conversations.
+    compact_conversations: bool = False
+
+    # Set by make_app() when metrics are enabled
+    metrics: Optional[BotMetrics] = None
+
     # Override these for your bot
 
     async def get_response(self, query: QueryRequest) -> AsyncIterable[ServerSentEvent]:
@@ -97,25 +128,57 @@ class PoeBot:
         """Override this to record errors from the Poe server."""
         logger.error(f"Error from Poe server: {error_request}")
 
+    async def on_startup(self) -> None:
+        """Override this to create resources shared by all requests.
+
+        For example, create API clients or LLM chains once here and register them in
+        self.resources, instead of creating them in every call to get_response.
+
+        """
+        pass
+
+    async def on_shutdown(self) -> None:
+        """Override this to clean up when the server shuts down.
+
+        Resources registered in self.resources are closed after this returns.
+
+        """
+        pass
+
+    async def on_cancel(self, query: QueryRequest) -> None:
+        """Override this to clean up when a query is abandoned before it finishes.
+
+        This happens when the client disconnects. get_response has already been
+        cancelled when this is called.
+
+        """
+        pass
+
+    @property
+    def resources(self) -> ResourceRegistry:
+        """Objects shared by all requests to this bot, closed when the server stops."""
+        registry = self.__dict__.get("_resources")
+        if registry is None:
+            registry = self.__dict__["_resources"] = ResourceRegistry()
+        return registry
+
     # Helpers for generating responses
 
     @staticmethod
     def text_event(text: str) -> ServerSentEvent:
-        return ServerSentEvent(data=json.dumps({"text": text}), event="text")
+        return TextEvent(text)
 
     @staticmethod
     def replace_response_event(text: str) -> ServerSentEvent:
-        return ServerSentEvent(
-            data=json.dumps({"text": text}), event="replace_response"
-        )
+        return EncodedEvent("replace_response", dumps({"text": text}))
 
     @staticmethod
     def done_event() -> ServerSentEvent:
-        return ServerSentEvent(data="{}", event="done")
+        return _DONE_EVENT
 
     @staticmethod
     def suggested_reply_event(text: str) -> ServerSentEvent:
-        return ServerSentEvent(data=json.dumps({"text": text}), event="suggested_reply")
+        return EncodedEvent("suggested_reply", dumps({"text": text}))
 
     @staticmethod
     def meta_event(
@@ -125,16 +188,8 @@ class PoeBot:
         linkify: bool = True,
         suggested_replies: bool = True,
     ) -> ServerSentEvent:
-        return ServerSentEvent(
-            data=json.dumps(
-                {
-                    "content_type": content_type,
-                    "refetch_settings": refetch_settings,
-                    "linkify": linkify,
-                    "suggested_replies": suggested_replies,
-                }
-            ),
-            event="meta",
+        return _make_meta_event(
+            content_type, refetch_settings, linkify, suggested_replies
         )
 
     @staticmethod
@@ -144,33 +199,140 @@ class PoeBot:
         data: Dict[str, Union[bool, str]] = {"allow_retry": allow_retry}
         if text is not None:
             data["text"] = text
-        return ServerSentEvent(data=json.dumps(data), event="error")
+        return EncodedEvent("error", dumps(data))
 
     # Internal handlers
 
     async def handle_report_feedback(
         self, feedback_request: ReportFeedbackRequest
     ) -> JSONResponse:
-        await self.on_feedback(feedback_request)
+        with track_request(self.metrics, "report_feedback"):
+            await self.on_feedback(feedback_request)
         return JSONResponse({})
 
     async def handle_report_error(
         self, error_request: ReportErrorRequest
     ) -> JSONResponse:
-        await self.on_error(error_request)
+        with track_request(self.metrics, "report_error"):
+            await self.on_error(error_request)
         return JSONResponse({})
 
+    async def handle_startup(self) -> None:
+        await self.on_startup()
+
+    async def handle_shutdown(self) -> None:
+        try:
+            await self.on_shutdown()
+        finally:
+            await self.resources.aclose()
+
     async def handle_settings(self, settings_request: SettingsRequest) -> JSONResponse:
-        settings = await self.get_settings(settings_request)
+        with track_request(self.metrics, "settings"):
+            settings = await self.get_settings(settings_request)
         return JSONResponse(settings.dict())
 
-    async def handle_query(self, query: QueryRequest) -> AsyncIterable[ServerSentEvent]:
+    async def _coalesce_text_events(
+        self, events: AsyncIterable[ServerSentEvent]
+    ) -> AsyncIterable[ServerSentEvent]:
+        loop = asyncio.get_running_loop()
+        iterator = events.__aiter__()
+        next_event: "Optional[asyncio.Future[ServerSentEvent]]" = None
+        buffer: List[str] = []
+        buffered_bytes = 0
+        flush_at = 0.0
+        sent_first_text = False
         try:
-            async for event in self.get_response(query):
-                yield event
+            while True:
+                if next_event is None:
+                    next_event = asyncio.ensure_future(iterator.__anext__())
+                if buffer:
+                    timeout = max(flush_at - loop.time(), 0)
+                    done, _ = await asyncio.wait({next_event}, timeout=timeout)
+                    if not done:
+                        yield self.text_event("".join(buffer))
+                        buffer.clear()
+                        buffered_bytes = 0
+                        continue
+                else:
+                    await asyncio.wait({next_event})
+                try:
+                    event = next_event.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_event = None
+
+                if not isinstance(event, TextEvent) or not sent_first_text:
+                    if buffer:
+                        yield self.text_event("".join(buffer))
+                        buffer.clear()
+                        buffered_bytes = 0
+                    sent_first_text = sent_first_text or event.event == "text"
+                    yield event
+                    continue
+                text = event.text
+                if not buffer:
+                    flush_at = loop.time() + self.coalesce_window_secs
+                buffer.append(text)
+                buffered_bytes += len(text.encode("utf-8"))
+                if buffered_bytes >= self.coalesce_max_bytes:
+                    yield self.text_event("".join(buffer))
+                    buffer.clear()
+                    buffered_bytes = 0
+            if buffer:
+                yield self.text_event("".join(buffer))
+        finally:
+            if next_event is not None:
+                next_event.cancel()
+
+    async def _produce_events(
+        self, query: QueryRequest, queue: "asyncio.Queue[Optional[ServerSentEvent]]"
+    ) -> None:
+        try:
+            events = self.get_response(query)
+            if self.coalesce_text_events:
+                events = self._coalesce_text_events(events)
+            async for event in events:
+                await queue.put(event)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.exception("Error responding to query")
-            yield self.error_event(repr(e), allow_retry=False)
+            await queue.put(self.error_event(repr(e), allow_retry=False))
+        await queue.put(None)
+
+    async def handle_query(self, query: QueryRequest) -> AsyncIterable[ServerSentEvent]:
+        # get_response runs in its own task so that it can be cancelled as soon as
+        # the client goes away, wherever it is currently waiting.
+        queue: "asyncio.Queue[Optional[ServerSentEvent]]" = asyncio.Queue(
+            maxsize=self.max_buffered_events
+        )
+        producer = asyncio.ensure_future(self._produce_events(query, queue))
+        tracker = self.metrics.start_query() if self.metrics is not None else None
+        completed = False
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                if tracker is not None:
+                    tracker.on_event(event)
+                yield event
+            completed = True
+        finally:
+            if tracker is not None:
+                tracker.finish(cancelled=not completed)
+            if not completed:
+                producer.cancel()
+                # Shield the hook from the cancellation that got us here
+                with anyio.CancelScope(shield=True):
+                    # Let get_response finish cleaning up before the hook runs
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await producer
+                    try:
+                        await self.on_cancel(query)
+                    except Exception:
+                        logger.exception("Error in on_cancel")
         yield self.done_event()
 
 
@@ -196,15 +358,81 @@ def find_auth_key(api_key: str, *, allow_without_key: bool = False) -> Optional[
     return api_key
 
 
-def make_app(
-    bot: PoeBot, api_key: str = "", *, allow_without_key: bool = False
+@dataclass
+class BotMount:
+    """A bot served by make_multi_bot_app().
+
+    Requests are routed to the bot by URL *path* and, if *host* is set, by the Host
+    header. *api_key* and *allow_without_key* are as for run(), but apply to this
+    bot only.
+
+    """
+
+    bot: PoeBot
+    api_key: str = ""
+    path: str = "/"
+    host: Optional[str] = None
+    allow_without_key: bool = False
+
+
+class _QueryResponse(EventSourceResponse):
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # If the client disconnected, close the stream right away instead of
+            # leaving it for the garbage collector, so the bot stops working on it.
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+def _create_app(
+    bots: Sequence[Tuple[str, PoeBot]],
+    *,
+    enable_metrics: bool,
+    loop_lag_threshold_secs: Optional[float],
 ) -> FastAPI:
-    """Create an app object. Arguments are as for run()."""
     app = FastAPI()
+    lag_monitor = (
+        None
+        if loop_lag_threshold_secs is None
+        else LoopLagMonitor(threshold_secs=loop_lag_threshold_secs)
+    )
     app.add_exception_handler(RequestValidationError, exception_handler)
 
-    global auth_key
-    auth_key = find_auth_key(api_key, allow_without_key=allow_without_key)
+    if enable_metrics:
+        for route, bot in bots:
+            if bot.metrics is None:
+                # Label by route, since several bots may share a class
+                bot.metrics = BotMetrics(route)
+        enable_client_metrics()
+
+        @app.get("/metrics")
+        async def metrics() -> Response:
+            return PlainTextResponse(
+                REGISTRY.render(), media_type="text/plain; version=0.0.4"
+            )
+
+    @app.on_event("startup")
+    async def startup() -> None:
+        # Open the pooled client used for bot-to-bot calls on the server's loop
+        get_shared_session()
+        if lag_monitor is not None:
+            lag_monitor.start()
+        for _, bot in bots:
+            await bot.handle_startup()
+
+    @app.on_event("shutdown")
+    async def shutdown() -> None:
+        for _, bot in bots:
+            try:
+                await bot.handle_shutdown()
+            except Exception:
+                logger.exception(f"Error while shutting down {type(bot).__name__}")
+        if lag_monitor is not None:
+            await lag_monitor.stop()
+        await close_shared_session()
 
     @app.get("/")
     async def index() -> Response:
@@ -215,32 +443,194 @@ def make_app(
             f' href="{url}">{url}</a>.</p></body></html>'
         )
 
+    # Uncomment this line to print out request and response
+    # app.add_middleware(LoggingMiddleware, sample_rate=1.0)
+    return app
+
+
+async def _handle_request(
+    bot: PoeBot, body: bytes, auth_key: Optional[str]
+) -> Response:
+    # The body is parsed here rather than by FastAPI, so that it is only parsed once
+    request = decode_request(body)
+    request_type = request.get("type")
+    if request_type == "query":
+        query = parse_query_request(
+            request, auth_key or "<missing>", compact=bot.compact_conversations
+        )
+        kwargs: Dict[str, Any] = {}
+        if bot.send_timeout_secs is not None:
+            kwargs["send_timeout"] = bot.send_timeout_secs
+        return _QueryResponse(bot.handle_query(query), **kwargs)
+    elif request_type == "settings":
+        return await bot.handle_settings(validate(SettingsRequest, request))
+    elif request_type == "report_feedback":
+        return await bot.handle_report_feedback(
+            validate(ReportFeedbackRequest, request)
+        )
+    elif request_type == "report_error":
+        return await bot.handle_report_error(validate(ReportErrorRequest, request))
+    else:
+        raise HTTPException(status_code=501, detail="Unsupported request type")
+
+
+def make_app(
+    bot: PoeBot,
+    api_key: str = "",
+    *,
+    allow_without_key: bool = False,
+    enable_metrics: bool = False,
+    loop_lag_threshold_secs: Optional[float] = None,
+) -> FastAPI:
+    """Create an app object. Arguments are as for run().
+
+    If *enable_metrics* is True, the app also serves Prometheus metrics for the bot
+    and for its requests to other bots at /metrics. If *loop_lag_threshold_secs* is
+    set, a warning is logged whenever the event loop is blocked for longer than that.
+
+    """
+    app = _create_app(
+        [("/", bot)],
+        enable_metrics=enable_metrics,
+        loop_lag_threshold_secs=loop_lag_threshold_secs,
+    )
+    auth_key = find_auth_key(api_key, allow_without_key=allow_without_key)
+
+    def auth_user(
+        authorization: HTTPAuthorizationCredentials = Depends(http_bearer),
+    ) -> None:
+        check_auth(authorization, auth_key)
+
     @app.post("/")
-    async def poe_post(request: Dict[str, Any], dict=Depends(auth_user)) -> Response:
-        if request["type"] == "query":
-            return EventSourceResponse(
-                bot.handle_query(
-                    QueryRequest.parse_obj(
-                        {**request, "api_key": auth_key or "<missing>"}
-                    )
-                )
-            )
-        elif request["type"] == "settings":
-            return await bot.handle_settings(SettingsRequest.parse_obj(request))
-        elif request["type"] == "report_feedback":
-            return await bot.handle_report_feedback(
-                ReportFeedbackRequest.parse_obj(request)
-            )
-        elif request["type"] == "report_error":
-            return await bot.handle_report_error(ReportErrorRequest.parse_obj(request))
-        else:
-            raise HTTPException(status_code=501, detail="Unsupported request type")
+    async def poe_post(request: Request, dict=Depends(auth_user)) -> Response:
+        return await _handle_request(bot, await request.body(), auth_key)
+
+    return app
+
+
+def _normalize_path(path: str) -> str:
+    return "/" + path.strip("/")
+
+
+def _format_route(host: Optional[str], path: str) -> str:
+    return path if host is None else f"{host}{path}"
+
+
+def make_multi_bot_app(
+    bots: Sequence[BotMount],
+    *,
+    enable_metrics: bool = False,
+    loop_lag_threshold_secs: Optional[float] = None,
+) -> FastAPI:
+    """Create an app object that serves several bots, each with its own API key.
+
+    All bots share one process and event loop. Each request is routed with a single
+    dictionary lookup on its host and path; mounts without a host match any host.
+    *enable_metrics* and *loop_lag_threshold_secs* are as for make_app().
+
+    """
+    routes: Dict[Tuple[Optional[str], str], Tuple[PoeBot, Optional[str]]] = {}
+    for mount in bots:
+        host = mount.host.lower() if mount.host is not None else None
+        route = (host, _normalize_path(mount.path))
+        if route in routes:
+            raise ValueError(f"More than one bot is mounted at {route}")
+        auth_key = find_auth_key(
+            mount.api_key, allow_without_key=mount.allow_without_key
+        )
+        routes[route] = (mount.bot, auth_key)
+    app = _create_app(
+        [(_format_route(*route), bot) for route, (bot, _) in routes.items()],
+        enable_metrics=enable_metrics,
+        loop_lag_threshold_secs=loop_lag_threshold_secs,
+    )
+
+    @app.post("/{path:path}")
+    async def poe_post(
+        path: str,
+        request: Request,
+        authorization: HTTPAuthorizationCredentials = Depends(http_bearer),
+    ) -> Response:
+        path = _normalize_path(path)
+        host = request.headers.get("host", "").split(":")[0].lower()
+        route = routes.get((host, path)) or routes.get((None, path))
+        if route is None:
+            raise HTTPException(status_code=404, detail="No bot at this path")
+        bot, auth_key = route
+        check_auth(authorization, auth_key)
+        return await _handle_request(bot, await request.body(), auth_key)
 
-    # Uncomment this line to print out request and response
-    # app.add_middleware(LoggingMiddleware)
     return app
 
 
+def _make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser("FastAPI sample Poe bot server")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes (requires run_app() with an import string)",
+    )
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default="auto")
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=2048,
+        help="Maximum number of pending connections",
+    )
+    parser.add_argument(
+        "--timeout-keep-alive",
+        type=int,
+        default=5,
+        help="Close idle keep-alive connections after this many seconds",
+    )
+    parser.add_argument(
+        "--timeout-graceful-shutdown",
+        type=int,
+        default=None,
+        help="On shutdown, wait this many seconds for in-flight responses to finish",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=None,
+        help="Respond with 503 once this many connections are open",
+    )
+    return parser
+
+
+def _run_uvicorn(
+    app: Union[FastAPI, str], args: argparse.Namespace, **kwargs: Any
+) -> None:
+    logger.info("Starting")
+    import uvicorn.config
+
+    if args.timeout_graceful_shutdown is not None:
+        # Only pass this when set, since older uvicorn versions do not support it
+        kwargs["timeout_graceful_shutdown"] = args.timeout_graceful_shutdown
+
+    log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    log_config["formatters"]["default"][
+        "fmt"
+    ] = "%(asctime)s - %(levelname)s - %(message)s"
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        log_config=log_config,
+        workers=args.workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.timeout_keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        **kwargs,
+    )
+
+
 def run(bot: PoeBot, api_key: str = "", *, allow_without_key: bool = False) -> None:
     """
     Run a Poe bot server using FastAPI.
@@ -253,23 +643,36 @@ def run(bot: PoeBot, api_key: str = "", *, allow_without_key: bool = False) -> N
     is provided. Requests will not be checked against any key. If an API key
     is provided, it is still checked.
 
+    The server runs in a single process. Use run_app() to run several workers.
+
     """
 
     app = make_app(bot, api_key, allow_without_key=allow_without_key)
 
-    parser = argparse.ArgumentParser("FastAPI sample Poe bot server")
-    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser = _make_parser()
     args = parser.parse_args()
-    port = args.port
+    if args.workers != 1:
+        parser.error("--workers requires run_app() with an import string")
+    _run_uvicorn(app, args)
 
-    logger.info("Starting")
-    import uvicorn.config
 
-    log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
-    log_config["formatters"]["default"][
-        "fmt"
-    ] = "%(asctime)s - %(levelname)s - %(message)s"
-    uvicorn.run(app, host="0.0.0.0", port=port, log_config=log_config)
+def run_app(app: str, *, factory: bool = False) -> None:
+    """
+    Run a Poe bot server from an import string, for use in production.
+
+    Because the app is imported by each worker process, this supports the --workers
+    command line flag, along with flags for the event loop and HTTP implementation,
+    the listen backlog, keep-alive timeouts and graceful shutdown.
+
+    :param app: The app as "module:attribute", for example "mybot:app" where
+    mybot.py contains ``app = make_app(MyBot())``.
+    :param factory: If True, the attribute is a function taking no arguments that
+    returns the app (for example, one that calls make_app()), and it is called
+    once in each worker.
+
+    """
+    args = _make_parser().parse_args()
+    _run_uvicorn(app, args, factory=factory)
 
 
 if __name__ == "__main__":
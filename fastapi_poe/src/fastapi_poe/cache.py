@@ -0,0 +1,137 @@
+"""
+
+Caches for responses from other Poe bots.
+
+"""
+import contextlib
+import json
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Generic, Optional, Tuple, TypeVar
+
+from .concurrency import run_sync
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """In-memory mapping that evicts the least recently used entries.
+
+    Entries also expire *ttl* seconds after they were set, if *ttl* is given.
+
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[K, Tuple[Optional[float], V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            return None
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        entry = self._data.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class ResponseCache(ABC):
+    """Base class for caches of final bot responses, keyed by a string."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached response for *key*, or None."""
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:
+        """Store the response for *key*."""
+
+
+class InMemoryResponseCache(ResponseCache):
+    """Response cache held in process memory with LRU eviction and a TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 60 * 60) -> None:
+        self._cache: LRUCache[str, str] = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        self._cache.set(key, value)
+
+
+class DiskResponseCache(ResponseCache):
+    """Response cache that stores one JSON file per entry in *directory*.
+
+    Entries survive restarts and can be shared by several worker processes.
+
+    """
+
+    def __init__(self, directory: str, ttl: Optional[float] = 24 * 60 * 60) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    async def get(self, key: str) -> Optional[str]:
+        return await run_sync(self._get, key)
+
+    async def set(self, key: str, value: str) -> None:
+        await run_sync(self._set, key, value)
+
+    # File I/O blocks, so it runs in worker threads instead of on the event loop
+
+    def _get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        expires_at = entry.get("expires_at")
+        if expires_at is not None and expires_at <= time.time():
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+        return entry.get("text")
+
+    def _set(self, key: str, value: str) -> None:
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "text": value}, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -4,14 +4,28 @@ Client for talking to other Poe bots through Poe's bot API.
 
 """
 import asyncio
-import contextlib
+import hashlib
 import json
+import time
 from dataclasses import dataclass, field
-from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, cast
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
 import httpx
 import httpx_sse
 
+from .cache import ResponseCache
+from .metrics import ClientMetrics
 from .types import ContentType, Identifier, QueryRequest, SettingsResponse
 
 API_VERSION = "1.0"
@@ -20,6 +34,10 @@ MESSAGE_LENGTH_LIMIT = 10_000
 IDENTIFIER_LENGTH = 32
 MAX_EVENT_COUNT = 1000
 
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
 ErrorHandler = Callable[[Exception, str], None]
 
 
@@ -59,6 +77,15 @@ class MetaMessage(BotMessage):
     content_type: ContentType = "text/markdown"
 
 
+@dataclass
+class FanoutResult:
+    """Outcome of querying one bot as part of a fan-out request."""
+
+    bot_name: str
+    text: Optional[str] = None
+    error: Optional[BaseException] = None
+
+
 def _safe_ellipsis(obj: object, limit: int) -> str:
     if not isinstance(obj, str):
         obj = repr(obj)
@@ -67,12 +94,21 @@ def _safe_ellipsis(obj: object, limit: int) -> str:
     return obj
 
 
+def _request_to_dict(request: QueryRequest) -> Dict[str, Any]:
+    # Serialize the messages individually, since they may be CompactMessages
+    data = request.dict(exclude={"query"})
+    data["query"] = [message.dict() for message in request.query]
+    return data
+
+
 @dataclass
 class _BotContext:
     endpoint: str
     api_key: str = field(repr=False)
     session: httpx.AsyncClient = field(repr=False)
     on_error: Optional[ErrorHandler] = field(default=None, repr=False)
+    # Whether the last perform_query_request() call received a "done" event
+    received_done: bool = field(default=False, init=False, repr=False)
 
     @property
     def headers(self) -> Dict[str, str]:
@@ -132,16 +168,28 @@ class _BotContext:
     async def perform_query_request(
         self, request: QueryRequest
     ) -> AsyncGenerator[BotMessage, None]:
-        chunks: List[str] = []
+        # Running totals so each event costs O(1) regardless of response length
+        has_text = False
+        total_length = 0
+        full_prompt: Optional[str] = None
+
+        def get_full_prompt() -> str:
+            # Serializing the whole conversation is expensive, so do it at most once
+            nonlocal full_prompt
+            if full_prompt is None:
+                full_prompt = repr(request)
+            return full_prompt
+
         message_id = request.message_id
         event_count = 0
         error_reported = False
+        self.received_done = False
         async with httpx_sse.aconnect_sse(
             self.session,
             "POST",
             self.endpoint,
             headers=self.headers,
-            json=request.dict(),
+            json=_request_to_dict(request),
         ) as event_source:
             async for event in event_source.aiter_sse():
                 event_count += 1
@@ -151,8 +199,9 @@ class _BotContext:
                     )
                     raise BotErrorNoRetry("Bot returned too many events")
                 if event.event == "done":
+                    self.received_done = True
                     # Don't send a report if we already told the bot about some other mistake.
-                    if not chunks and not error_reported:
+                    if not has_text and not error_reported:
                         await self.report_error(
                             "Bot returned no text in response",
                             {"message_id": message_id},
@@ -166,7 +215,7 @@ class _BotContext:
                     text = await self._get_single_json_field(
                         event.data, "replace_response", message_id
                     )
-                    chunks.clear()
+                    total_length = 0
                 elif event.event == "suggested_reply":
                     text = await self._get_single_json_field(
                         event.data, "suggested_reply", message_id
@@ -174,7 +223,7 @@ class _BotContext:
                     yield BotMessage(
                         text=text,
                         raw_response={"type": event.event, "text": event.data},
-                        full_prompt=repr(request),
+                        full_prompt=get_full_prompt(),
                         is_suggested_reply=True,
                     )
                     continue
@@ -213,7 +262,7 @@ class _BotContext:
                     yield MetaMessage(
                         "",
                         data,
-                        full_prompt=repr(request),
+                        full_prompt=get_full_prompt(),
                         linkify=linkify,
                         suggested_replies=send_suggested_replies,
                         content_type=cast(ContentType, content_type),
@@ -240,8 +289,8 @@ class _BotContext:
                     )
                     error_reported = True
                     continue
-                chunks.append(text)
-                total_length = sum(len(chunk) for chunk in chunks)
+                has_text = True
+                total_length += len(text)
                 if total_length > MESSAGE_LENGTH_LIMIT:
                     await self.report_error(
                         "Bot returned too much text",
@@ -251,7 +300,7 @@ class _BotContext:
                 yield BotMessage(
                     text=text,
                     raw_response={"type": event.event, "text": event.data},
-                    full_prompt=repr(request),
+                    full_prompt=get_full_prompt(),
                     is_replace_response=(event.event == "replace_response"),
                 )
         await self.report_error(
@@ -292,6 +341,110 @@ class _BotContext:
         return cast(Dict[str, object], parsed)
 
 
+_shared_session: Optional[httpx.AsyncClient] = None
+# The loop that _shared_session's connections belong to
+_shared_session_loop: Optional[asyncio.AbstractEventLoop] = None
+_shared_session_limits = httpx.Limits(
+    max_connections=DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections=DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+)
+_shared_session_http2 = True
+
+
+def configure_shared_session(
+    *,
+    max_connections: Optional[int] = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections: Optional[int] = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: Optional[float] = DEFAULT_KEEPALIVE_EXPIRY,
+    http2: bool = True,
+) -> None:
+    """Configure the connection pool used when no session is passed to the client.
+
+    Takes effect the next time the shared session is created, so call this before
+    the first request (or after close_shared_session()).
+
+    """
+    global _shared_session_limits, _shared_session_http2
+    _shared_session_limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    _shared_session_http2 = http2
+
+
+def get_shared_session() -> httpx.AsyncClient:
+    """Return the process-wide pooled client, creating it if necessary.
+
+    Pooled connections can only be used on the event loop that opened them, so the
+    client is replaced when it is used from a different event loop.
+
+    """
+    global _shared_session, _shared_session_loop
+    loop = asyncio.get_running_loop()
+    if (
+        _shared_session is None
+        or _shared_session.is_closed
+        or _shared_session_loop is not loop
+    ):
+        _shared_session = httpx.AsyncClient(
+            http2=_shared_session_http2, limits=_shared_session_limits
+        )
+        _shared_session_loop = loop
+    return _shared_session
+
+
+async def close_shared_session() -> None:
+    """Close the process-wide pooled client, if it was created."""
+    global _shared_session, _shared_session_loop
+    session, _shared_session = _shared_session, None
+    loop, _shared_session_loop = _shared_session_loop, None
+    # A client from another loop cannot be closed from this one, so it is dropped
+    if session is not None and loop is asyncio.get_running_loop():
+        await session.aclose()
+
+
+_metrics: Optional[ClientMetrics] = None
+
+
+def enable_metrics() -> None:
+    """Start recording metrics for requests to other bots.
+
+    They are exposed together with the server metrics, see make_app().
+
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = ClientMetrics()
+
+
+def make_cache_key(request: QueryRequest, bot_name: str) -> str:
+    """Returns a cache key for sending *request* to *bot_name*.
+
+    Only the conversation contents are used, so volatile fields such as message IDs,
+    timestamps and the API key do not prevent cache hits.
+
+    """
+    payload = [
+        bot_name,
+        [
+            [message.role, message.content, message.content_type]
+            for message in request.query
+        ],
+    ]
+    serialized = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _add_response_chunk(chunks: List[str], message: BotMessage) -> None:
+    if isinstance(message, MetaMessage) or message.is_suggested_reply:
+        return
+    if message.is_replace_response:
+        chunks.clear()
+    chunks.append(message.text)
+
+
 def _default_error_handler(e: Exception, msg: str) -> None:
     print("Error in Poe API Bot:", msg, e)
 
@@ -306,42 +459,239 @@ async def stream_request(
     num_tries: int = 2,
     retry_sleep_time: float = 0.5,
     base_url: str = "https://api.poe.com/bot/",
+    cache: Optional[ResponseCache] = None,
 ) -> AsyncGenerator[BotMessage, None]:
-    """Streams BotMessages from an API bot."""
-    async with contextlib.AsyncExitStack() as stack:
-        if session is None:
-            session = await stack.enter_async_context(httpx.AsyncClient())
-        url = f"{base_url}{bot_name}"
-        ctx = _BotContext(
-            endpoint=url, api_key=api_key, session=session, on_error=on_error
-        )
-        got_response = False
-        for i in range(num_tries):
-            try:
-                async for message in ctx.perform_query_request(request):
-                    got_response = True
-                    yield message
-                break
-            except BotErrorNoRetry:
-                raise
-            except Exception as e:
-                on_error(e, f"Bot request to {bot_name} failed on try {i}")
-                if got_response or i == num_tries - 1:
-                    raise BotError(f"Error communicating with bot {bot_name}") from e
-                await asyncio.sleep(retry_sleep_time)
-
-
-async def get_final_response(request: QueryRequest, bot_name: str, api_key: str) -> str:
+    """Streams BotMessages from an API bot.
+
+    If no session is passed, the process-wide pooled client from
+    get_shared_session() is used, so connections are reused across calls.
+
+    If a *cache* is passed, a cached response for the same conversation is replayed
+    as a single text message instead of querying the bot, and new responses are
+    stored in the cache once the bot sends its "done" event, so truncated responses
+    are never cached.
+
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(request, bot_name)
+        cached_text = await cache.get(cache_key)
+        if cached_text is not None:
+            yield BotMessage(
+                text=cached_text,
+                raw_response={
+                    "type": "text",
+                    "text": json.dumps({"text": cached_text}),
+                },
+                full_prompt=repr(request),
+            )
+            return
+    if session is None:
+        session = get_shared_session()
+    url = f"{base_url}{bot_name}"
+    ctx = _BotContext(endpoint=url, api_key=api_key, session=session, on_error=on_error)
+    metrics = _metrics
+    start = time.perf_counter() if metrics is not None else 0.0
+    got_response = False
+    chunks: List[str] = []
+    for i in range(num_tries):
+        try:
+            async for message in ctx.perform_query_request(request):
+                if metrics is not None and not got_response:
+                    metrics.time_to_first_message.observe(
+                        time.perf_counter() - start, bot_name
+                    )
+                got_response = True
+                if cache_key is not None:
+                    _add_response_chunk(chunks, message)
+                yield message
+            break
+        except BotErrorNoRetry:
+            if metrics is not None:
+                metrics.requests.inc(bot_name, "error")
+            raise
+        except Exception as e:
+            on_error(e, f"Bot request to {bot_name} failed on try {i}")
+            if got_response or i == num_tries - 1:
+                if metrics is not None:
+                    metrics.requests.inc(bot_name, "error")
+                raise BotError(f"Error communicating with bot {bot_name}") from e
+            if metrics is not None:
+                metrics.retries.inc(bot_name)
+            await asyncio.sleep(retry_sleep_time)
+    if metrics is not None:
+        metrics.requests.inc(bot_name, "ok")
+        metrics.duration.observe(time.perf_counter() - start, bot_name)
+    if cache is not None and cache_key is not None and ctx.received_done and chunks:
+        await cache.set(cache_key, "".join(chunks))
+
+
+async def get_final_response(
+    request: QueryRequest,
+    bot_name: str,
+    api_key: str,
+    *,
+    session: Optional[httpx.AsyncClient] = None,
+    cache: Optional[ResponseCache] = None,
+) -> str:
     """Gets the final response from an API bot."""
     chunks: List[str] = []
-    async for message in stream_request(request, bot_name, api_key):
-        if isinstance(message, MetaMessage):
-            continue
-        if message.is_suggested_reply:
-            continue
-        if message.is_replace_response:
-            chunks.clear()
-        chunks.append(message.text)
+    async for message in stream_request(
+        request, bot_name, api_key, session=session, cache=cache
+    ):
+        _add_response_chunk(chunks, message)
     if not chunks:
         raise BotError(f"Bot {bot_name} sent no response")
     return "".join(chunks)
+
+
+async def _cancel_tasks(tasks: Iterable["asyncio.Future[Any]"]) -> None:
+    tasks = list(tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def get_first_final_response(
+    request: QueryRequest,
+    bot_names: Sequence[str],
+    api_key: str,
+    *,
+    session: Optional[httpx.AsyncClient] = None,
+    timeout: Optional[float] = None,
+) -> FanoutResult:
+    """Queries several bots concurrently and returns the first complete response.
+
+    Requests to the other bots are cancelled as soon as one bot finishes. Bots that
+    fail are skipped; BotError is raised if none succeeds within *timeout* seconds.
+
+    """
+    if session is None:
+        session = get_shared_session()
+    tasks: Dict["asyncio.Future[str]", str] = {
+        asyncio.ensure_future(
+            get_final_response(request, bot_name, api_key, session=session)
+        ): bot_name
+        for bot_name in bot_names
+    }
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    errors: List[BaseException] = []
+    try:
+        pending = set(tasks)
+        while pending:
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    return FanoutResult(bot_name=tasks[task], text=task.result())
+                errors.append(error)
+    finally:
+        await _cancel_tasks(tasks)
+    raise BotError(f"No response from any of {list(bot_names)}") from (
+        errors[-1] if errors else None
+    )
+
+
+async def stream_first_responder(
+    request: QueryRequest,
+    bot_names: Sequence[str],
+    api_key: str,
+    *,
+    session: Optional[httpx.AsyncClient] = None,
+    on_error: ErrorHandler = _default_error_handler,
+) -> AsyncGenerator[Tuple[str, BotMessage], None]:
+    """Streams the response of whichever bot sends its first token first.
+
+    Yields (bot_name, message) pairs from the winning bot only. The other streams
+    are cancelled as soon as a winner is known; meta events do not count as tokens.
+
+    """
+    if session is None:
+        session = get_shared_session()
+    streams = {
+        bot_name: stream_request(
+            request, bot_name, api_key, session=session, on_error=on_error
+        )
+        for bot_name in bot_names
+    }
+    buffered: Dict[str, List[BotMessage]] = {bot_name: [] for bot_name in streams}
+    pending: Dict["asyncio.Future[BotMessage]", str] = {
+        asyncio.ensure_future(stream.__anext__()): bot_name
+        for bot_name, stream in streams.items()
+    }
+    winner: Optional[str] = None
+    errors: List[BaseException] = []
+    try:
+        while pending and winner is None:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                bot_name = pending.pop(task)
+                try:
+                    message = task.result()
+                except StopAsyncIteration:
+                    continue
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if winner is not None:
+                    continue
+                buffered[bot_name].append(message)
+                if isinstance(message, MetaMessage):
+                    next_message = asyncio.ensure_future(streams[bot_name].__anext__())
+                    pending[next_message] = bot_name
+                else:
+                    winner = bot_name
+        await _cancel_tasks(pending)
+        pending.clear()
+        for bot_name, stream in streams.items():
+            if bot_name != winner:
+                await stream.aclose()
+        if winner is None:
+            raise BotError(f"No response from any of {list(bot_names)}") from (
+                errors[-1] if errors else None
+            )
+
+        for message in buffered[winner]:
+            yield winner, message
+        async for message in streams[winner]:
+            yield winner, message
+    finally:
+        await _cancel_tasks(pending)
+        for stream in streams.values():
+            await stream.aclose()
+
+
+async def gather_final_responses(
+    request: QueryRequest,
+    bot_names: Sequence[str],
+    api_key: str,
+    *,
+    session: Optional[httpx.AsyncClient] = None,
+    timeout: Optional[float] = None,
+) -> List[FanoutResult]:
+    """Queries several bots concurrently and waits for all of them.
+
+    Each bot gets its own *timeout*; a bot that fails or times out is reported
+    through FanoutResult.error instead of failing the whole call. Results are in
+    the same order as *bot_names*.
+
+    """
+    if session is None:
+        session = get_shared_session()
+
+    async def query_bot(bot_name: str) -> FanoutResult:
+        try:
+            text = await asyncio.wait_for(
+                get_final_response(request, bot_name, api_key, session=session), timeout
+            )
+        except Exception as e:
+            return FanoutResult(bot_name=bot_name, error=e)
+        return FanoutResult(bot_name=bot_name, text=text)
+
+    return list(await asyncio.gather(*(query_bot(bot_name) for bot_name in bot_names)))
@@ -0,0 +1,104 @@
+"""
+
+Memory-compact representation of conversations.
+
+A ProtocolMessage is a pydantic model with an instance dict, a set of the fields that
+were passed in and its own feedback list. For long conversations, which are kept alive
+for the whole response, that overhead adds up. CompactMessage has the same attributes
+but uses __slots__, shares role and content type strings, and stores feedback as a
+tuple that is shared between all messages without feedback.
+
+"""
+import sys
+from typing import Any, Dict, Sequence, Tuple
+
+from fastapi_poe.types import MessageFeedback, ProtocolMessage
+
+_NO_FEEDBACK: Tuple[MessageFeedback, ...] = ()
+
+
+class CompactMessage:
+    """A read-only message with the same attributes as ProtocolMessage."""
+
+    __slots__ = (
+        "role",
+        "content",
+        "content_type",
+        "timestamp",
+        "message_id",
+        "feedback",
+    )
+
+    role: str
+    content: str
+    content_type: str
+    timestamp: int
+    message_id: str
+    feedback: Tuple[MessageFeedback, ...]
+
+    def __init__(
+        self,
+        role: str,
+        content: str,
+        content_type: str = "text/markdown",
+        timestamp: int = 0,
+        message_id: str = "",
+        feedback: Sequence[MessageFeedback] = _NO_FEEDBACK,
+    ) -> None:
+        set_attr = object.__setattr__
+        set_attr(self, "role", sys.intern(role))
+        set_attr(self, "content", content)
+        set_attr(self, "content_type", sys.intern(content_type))
+        set_attr(self, "timestamp", timestamp)
+        set_attr(self, "message_id", message_id)
+        set_attr(self, "feedback", tuple(feedback) if feedback else _NO_FEEDBACK)
+
+    @classmethod
+    def from_protocol_message(cls, message: ProtocolMessage) -> "CompactMessage":
+        return cls(
+            message.role,
+            message.content,
+            message.content_type,
+            message.timestamp,
+            message.message_id,
+            message.feedback,
+        )
+
+    def to_protocol_message(self) -> ProtocolMessage:
+        return ProtocolMessage.parse_obj(self.dict())
+
+    def dict(self) -> Dict[str, Any]:
+        """Returns the message as a dict, like ProtocolMessage.dict()."""
+        return {
+            "role": self.role,
+            "content": self.content,
+            "content_type": self.content_type,
+            "timestamp": self.timestamp,
+            "message_id": self.message_id,
+            "feedback": [feedback.dict() for feedback in self.feedback],
+        }
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, CompactMessage):
+            return all(
+                getattr(self, name) == getattr(other, name) for name in self.__slots__
+            )
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+CompactConversation = Tuple[CompactMessage, ...]
+
+
+def compact_conversation(messages: Sequence[ProtocolMessage]) -> CompactConversation:
+    """Converts validated messages to a compact, read-only conversation."""
+    return tuple(CompactMessage.from_protocol_message(message) for message in messages)
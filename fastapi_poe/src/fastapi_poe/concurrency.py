@@ -0,0 +1,130 @@
+"""
+
+Helpers for calling blocking code from bots without stalling the event loop.
+
+All requests share one event loop, so a synchronous LLM call or a synchronous token
+stream inside get_response delays every other response. run_sync() and
+iterate_in_thread() run such code in a bounded pool of worker threads instead.
+LoopLagMonitor logs when something blocks the loop anyway.
+
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import threading
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, TypeVar
+
+import anyio
+import anyio.to_thread
+
+T = TypeVar("T")
+
+DEFAULT_MAX_THREADS = 40
+
+logger = logging.getLogger("uvicorn.default")
+
+_limiter: Optional[anyio.CapacityLimiter] = None
+_max_threads = DEFAULT_MAX_THREADS
+
+
+def configure_thread_pool(max_threads: int = DEFAULT_MAX_THREADS) -> None:
+    """Set how many threads run_sync() and iterate_in_thread() may use at once."""
+    global _max_threads
+    _max_threads = max_threads
+    if _limiter is not None:
+        _limiter.total_tokens = max_threads
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(_max_threads)
+    return _limiter
+
+
+async def run_sync(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Call *func* in a worker thread and return its result.
+
+    If the caller is cancelled, the call still runs to completion in its thread, but
+    its result is discarded.
+
+    """
+    if kwargs:
+        func = functools.partial(func, **kwargs)
+    return await anyio.to_thread.run_sync(func, *args, limiter=_get_limiter())
+
+
+_EXHAUSTED = object()
+
+
+async def iterate_in_thread(iterable: Iterable[T]) -> AsyncIterator[T]:
+    """Iterate over a synchronous iterable, such as a token stream, in worker threads.
+
+    Each item is fetched with one call to run_sync(). Generators are closed when the
+    async iterator is closed, for example because the client disconnected.
+
+    """
+    iterator = await run_sync(iter, iterable)
+    # A cancelled fetch keeps running in its thread, so closing must wait for it
+    lock = threading.Lock()
+
+    def fetch() -> Any:
+        with lock:
+            return next(iterator, _EXHAUSTED)
+
+    def close() -> None:
+        with lock:
+            iterator.close()  # type: ignore[attr-defined]
+
+    try:
+        while True:
+            item = await run_sync(fetch)
+            if item is _EXHAUSTED:
+                return
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            with anyio.CancelScope(shield=True):
+                await run_sync(close)
+
+
+class LoopLagMonitor:
+    """Logs a warning whenever the event loop is blocked for too long.
+
+    Every *interval_secs*, the monitor measures how late its own wakeup was. Lag
+    above *threshold_secs* means some code ran on the loop for that long without
+    yielding, delaying every other request.
+
+    """
+
+    def __init__(
+        self, threshold_secs: float = 0.1, interval_secs: float = 0.25
+    ) -> None:
+        self.threshold_secs = threshold_secs
+        self.interval_secs = interval_secs
+        self.max_lag_secs = 0.0
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        task = self._task
+        if task is None:
+            return
+        self._task = None
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval_secs)
+            lag = loop.time() - start - self.interval_secs
+            self.max_lag_secs = max(self.max_lag_secs, lag)
+            if lag > self.threshold_secs:
+                logger.warning(f"Event loop was blocked for {lag:.3f}s")
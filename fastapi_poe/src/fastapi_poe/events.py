@@ -0,0 +1,52 @@
+"""
+
+Fast encoding of server-sent events for the Poe protocol.
+
+"""
+import json
+from typing import Any
+
+from sse_starlette.sse import ServerSentEvent
+
+try:
+    import orjson  # type: ignore[import]
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializes *obj* to JSON bytes, using orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+class EncodedEvent(ServerSentEvent):
+    """A ServerSentEvent whose wire frame is built once, when it is created.
+
+    *payload* must be a single line of JSON (as produced by dumps()), so the frame
+    can be assembled directly as bytes instead of going through
+    ServerSentEvent.encode() for every event.
+
+    """
+
+    def __init__(self, event: str, payload: bytes) -> None:
+        super().__init__(payload.decode("utf-8"), event=event)
+        self._frame = b"".join(
+            (b"event: ", event.encode("ascii"), b"\r\ndata: ", payload, b"\r\n\r\n")
+        )
+
+    def encode(self) -> bytes:
+        return self._frame
+
+
+class TextEvent(EncodedEvent):
+    """An EncodedEvent for a "text" event that also keeps its text.
+
+    Consecutive text events can then be merged without decoding their payloads.
+
+    """
+
+    def __init__(self, text: str) -> None:
+        super().__init__("text", dumps({"text": text}))
+        self.text = text
@@ -0,0 +1,308 @@
+"""
+
+Prometheus-style metrics for bot servers and the bot client.
+
+Metrics are only collected once they have been enabled, either by passing
+enable_metrics=True to make_app() or by calling fastapi_poe.client.enable_metrics().
+
+"""
+import bisect
+import contextlib
+import threading
+import time
+from typing import (
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from sse_starlette.sse import ServerSentEvent
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+EVENT_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTE_BUCKETS = (100, 1_000, 5_000, 10_000, 50_000, 100_000, 500_000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """A monotonically increasing value for each combination of label values."""
+
+    type_name = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str]
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Histogram:
+    """Counts of observed values in buckets, plus their sum and count."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: non-cumulative bucket counts (the last one is +Inf) and sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[labelvalues] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def render(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(
+                (labelvalues, list(counts), total[0])
+                for labelvalues, (counts, total) in self._values.items()
+            )
+        names = (*self.labelnames, "le")
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(names, (*labelvalues, str(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """A collection of metrics that can be rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Union[Counter, Histogram]] = {}
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Counter(name, documentation, labelnames)
+        assert isinstance(metric, Counter), f"{name} is not a counter"
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Histogram(
+                name, documentation, labelnames, buckets
+            )
+        assert isinstance(metric, Histogram), f"{name} is not a histogram"
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class QueryTracker:
+    """Records the metrics for a single query response."""
+
+    def __init__(self, metrics: "BotMetrics") -> None:
+        self._metrics = metrics
+        self._start = time.perf_counter()
+        self._first_event_at: Optional[float] = None
+        self._events = 0
+        self._bytes = 0
+        self._errored = False
+
+    def on_event(self, event: ServerSentEvent) -> None:
+        if self._first_event_at is None:
+            self._first_event_at = time.perf_counter()
+        self._events += 1
+        self._bytes += len(event.encode())
+        if event.event == "error":
+            self._errored = True
+
+    def finish(self, *, cancelled: bool = False) -> None:
+        metrics = self._metrics
+        bot_name = metrics.bot_name
+        if self._first_event_at is not None:
+            metrics.time_to_first_event.observe(
+                self._first_event_at - self._start, bot_name
+            )
+        if cancelled:
+            outcome = "cancelled"
+        else:
+            outcome = "error" if self._errored else "done"
+            metrics.time_to_done.observe(time.perf_counter() - self._start, bot_name)
+        metrics.events_per_response.observe(self._events, bot_name)
+        metrics.bytes_per_response.observe(self._bytes, bot_name)
+        metrics.query_outcomes.inc(bot_name, outcome)
+
+
+class BotMetrics:
+    """Metrics recorded by the request handlers of one bot."""
+
+    def __init__(self, bot_name: str, registry: MetricsRegistry = REGISTRY) -> None:
+        self.bot_name = bot_name
+        self.requests = registry.counter(
+            "poe_bot_requests_total", "Requests received, by type", ("bot", "type")
+        )
+        self.request_errors = registry.counter(
+            "poe_bot_request_errors_total",
+            "Requests whose handler raised an exception, by type",
+            ("bot", "type"),
+        )
+        self.request_duration = registry.histogram(
+            "poe_bot_request_duration_seconds",
+            "Time to handle settings, report_feedback and report_error requests",
+            ("bot", "type"),
+        )
+        self.time_to_first_event = registry.histogram(
+            "poe_bot_query_time_to_first_event_seconds",
+            "Time from receiving a query to sending its first event",
+            ("bot",),
+        )
+        self.time_to_done = registry.histogram(
+            "poe_bot_query_time_to_done_seconds",
+            "Time from receiving a query to finishing its response",
+            ("bot",),
+        )
+        self.events_per_response = registry.histogram(
+            "poe_bot_query_events",
+            "Events sent per query response, excluding the done event",
+            ("bot",),
+            EVENT_COUNT_BUCKETS,
+        )
+        self.bytes_per_response = registry.histogram(
+            "poe_bot_query_bytes",
+            "Bytes streamed per query response, excluding the done event",
+            ("bot",),
+            BYTE_BUCKETS,
+        )
+        self.query_outcomes = registry.counter(
+            "poe_bot_query_outcomes_total",
+            "Query responses by outcome (done, error or cancelled)",
+            ("bot", "outcome"),
+        )
+
+    def start_query(self) -> QueryTracker:
+        self.requests.inc(self.bot_name, "query")
+        return QueryTracker(self)
+
+    @contextlib.contextmanager
+    def _track_request(self, request_type: str) -> Iterator[None]:
+        self.requests.inc(self.bot_name, request_type)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.request_errors.inc(self.bot_name, request_type)
+            raise
+        finally:
+            self.request_duration.observe(
+                time.perf_counter() - start, self.bot_name, request_type
+            )
+
+
+_NO_TRACKING: ContextManager[None] = contextlib.nullcontext()
+
+
+def track_request(
+    metrics: Optional[BotMetrics], request_type: str
+) -> ContextManager[None]:
+    """Records the count and duration of a request, if metrics are enabled."""
+    if metrics is None:
+        return _NO_TRACKING
+    return metrics._track_request(request_type)
+
+
+class ClientMetrics:
+    """Metrics recorded by fastapi_poe.client for requests to other bots."""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY) -> None:
+        self.requests = registry.counter(
+            "poe_client_requests_total",
+            "Requests to other bots, by outcome (ok or error)",
+            ("bot", "outcome"),
+        )
+        self.retries = registry.counter(
+            "poe_client_retries_total", "Retried requests to other bots", ("bot",)
+        )
+        self.time_to_first_message = registry.histogram(
+            "poe_client_time_to_first_message_seconds",
+            "Time from sending a request to another bot to its first message",
+            ("bot",),
+        )
+        self.duration = registry.histogram(
+            "poe_client_request_duration_seconds",
+            "Time to stream a complete response from another bot",
+            ("bot",),
+        )
@@ -0,0 +1,158 @@
+"""
+
+ASGI middleware for logging requests and responses.
+
+"""
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, MutableMapping, Optional
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler formats the message in the calling thread by default; leave
+        # that to the listener thread so it stays off the event loop.
+        return record
+
+
+class _ForwardingHandler(logging.Handler):
+    def __init__(self, target: logging.Logger) -> None:
+        super().__init__()
+        self.target = target
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.target.handle(record)
+
+
+_listeners_lock = threading.Lock()
+_queue_loggers: Dict[str, logging.Logger] = {}
+
+
+def _get_queue_logger(target: logging.Logger) -> logging.Logger:
+    """Returns a logger whose records are passed to *target* on a background thread."""
+    with _listeners_lock:
+        queue_logger = _queue_loggers.get(target.name)
+        if queue_logger is None:
+            record_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+            listener = QueueListener(record_queue, _ForwardingHandler(target))
+            listener.start()
+            atexit.register(listener.stop)
+            queue_logger = logging.getLogger(f"fastapi_poe.queued.{target.name}")
+            queue_logger.addHandler(_DeferredQueueHandler(record_queue))
+            queue_logger.setLevel(logging.DEBUG)
+            queue_logger.propagate = False
+            _queue_loggers[target.name] = queue_logger
+        return queue_logger
+
+
+def _get_header(headers: Any, name: bytes) -> bytes:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return b""
+
+
+class LoggingMiddleware:
+    """Pure ASGI middleware that logs requests, responses and streamed events.
+
+    Log records are handed to a background thread, so logging does not block the
+    event loop, and bodies are never parsed. Only a *sample_rate* fraction of
+    requests is logged, and at most *max_body_bytes* of each body (and of each
+    streamed chunk) is included. Server-sent events are logged chunk by chunk as
+    they are sent, without buffering the response. Bodies are logged at DEBUG level.
+
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        sample_rate: float = 1.0,
+        max_body_bytes: int = 2048,
+        log_streamed_events: bool = True,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.app = app
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+        self.log_streamed_events = log_streamed_events
+        self.target = logger or logging.getLogger("uvicorn.default")
+        self.logger = _get_queue_logger(self.target)
+
+    def _truncate(self, body: bytes) -> bytes:
+        if len(body) > self.max_body_bytes:
+            return body[: self.max_body_bytes] + b"..."
+        return body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or not self.target.isEnabledFor(logging.INFO)
+            or (self.sample_rate < 1 and random.random() >= self.sample_rate)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        logger = self.logger
+        log_bodies = self.target.isEnabledFor(logging.DEBUG)
+        start = time.perf_counter()
+        logger.info("Request: %s %s", scope["method"], scope["path"])
+
+        request_body = bytearray()
+
+        async def logged_receive() -> Message:
+            message = await receive()
+            if log_bodies and message["type"] == "http.request":
+                remaining = self.max_body_bytes + 1 - len(request_body)
+                if remaining > 0:
+                    request_body.extend(message.get("body", b"")[:remaining])
+                if not message.get("more_body", False):
+                    logger.debug(
+                        "Request body: %r", self._truncate(bytes(request_body))
+                    )
+            return message
+
+        is_event_stream = False
+        response_body = bytearray()
+
+        async def logged_send(message: Message) -> None:
+            nonlocal is_event_stream
+            if message["type"] == "http.response.start":
+                logger.info("Response status: %s", message["status"])
+                content_type = _get_header(message.get("headers", ()), b"content-type")
+                is_event_stream = content_type.startswith(b"text/event-stream")
+            elif log_bodies and message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if is_event_stream:
+                    if self.log_streamed_events and body:
+                        logger.debug("Response event: %r", self._truncate(body))
+                else:
+                    remaining = self.max_body_bytes + 1 - len(response_body)
+                    if remaining > 0:
+                        response_body.extend(body[:remaining])
+                    if not message.get("more_body", False):
+                        logger.debug(
+                            "Response body: %r", self._truncate(bytes(response_body))
+                        )
+            await send(message)
+
+        try:
+            await self.app(scope, logged_receive, logged_send)
+        finally:
+            logger.info(
+                "Request finished: %s %s in %.3fs",
+                scope["method"],
+                scope["path"],
+                time.perf_counter() - start,
+            )
@@ -0,0 +1,147 @@
+"""
+
+Fast parsing of Poe protocol requests.
+
+Query requests carry the whole conversation, so validating every message with
+pydantic dominates the cost of parsing them. parse_query_request() checks the usual
+shape of each message directly and builds the models without validating them again.
+Anything it does not recognize is handed to pydantic, so the result (or the validation
+error) is the same as with QueryRequest.parse_obj().
+
+"""
+import json
+from typing import Any, Dict, Set, Type, TypeVar, Union
+
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import DictError
+
+from fastapi_poe.compact import CompactMessage, compact_conversation
+from fastapi_poe.events import orjson
+from fastapi_poe.types import ProtocolMessage, QueryRequest
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+_ROLES = frozenset(("system", "user", "bot"))
+_CONTENT_TYPES = frozenset(("text/markdown", "text/plain"))
+_MESSAGE_FIELDS = frozenset(ProtocolMessage.__fields__)
+_QUERY_STR_FIELDS = ("version", "user_id", "conversation_id", "message_id")
+_QUERY_FIELDS_SET = frozenset((*_QUERY_STR_FIELDS, "type", "query", "api_key"))
+
+
+def loads(data: bytes) -> Any:
+    """Parses JSON bytes, using orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode_request(body: bytes) -> Dict[str, Any]:
+    """Parses the body of a request to a bot, which must be a JSON object."""
+    try:
+        request = loads(body)
+    except ValueError as ex:
+        raise RequestValidationError([ErrorWrapper(ex, ("body",))], body=body)
+    if not isinstance(request, dict):
+        raise RequestValidationError([ErrorWrapper(DictError(), ("body",))], body=body)
+    return request
+
+
+def validate(model: Type[ModelT], data: Dict[str, Any]) -> ModelT:
+    """Validates *data* as *model*, raising RequestValidationError if it is invalid."""
+    try:
+        return model.parse_obj(data)
+    except ValidationError as ex:
+        raise RequestValidationError([ErrorWrapper(ex, ("body",))], body=data)
+
+
+def _construct(
+    model: Type[ModelT], fields_set: Set[str], values: Dict[str, Any]
+) -> ModelT:
+    # What BaseModel.construct() does, minus its per-field loop to fill in defaults,
+    # which is the main cost for long conversations. *values* must have every field.
+    instance = model.__new__(model)
+    object.__setattr__(instance, "__dict__", values)
+    object.__setattr__(instance, "__fields_set__", fields_set)
+    return instance
+
+
+def _construct_message(
+    data: Any, compact: bool
+) -> Union[ProtocolMessage, CompactMessage, None]:
+    """Builds a message if *data* is plainly valid, otherwise returns None."""
+    if type(data) is not dict or not _MESSAGE_FIELDS.issuperset(data):
+        return None
+    role = data.get("role")
+    content = data.get("content")
+    content_type = data.get("content_type", "text/markdown")
+    timestamp = data.get("timestamp", 0)
+    message_id = data.get("message_id", "")
+    if (
+        type(role) is not str
+        or role not in _ROLES
+        or type(content) is not str
+        or type(content_type) is not str
+        or content_type not in _CONTENT_TYPES
+        or type(timestamp) is not int
+        or type(message_id) is not str
+        # Feedback is rare, so leave validating it to pydantic
+        or data.get("feedback", []) != []
+    ):
+        return None
+    if compact:
+        return CompactMessage(role, content, content_type, timestamp, message_id)
+    return _construct(
+        ProtocolMessage,
+        set(data),
+        {
+            "role": role,
+            "content": content,
+            "content_type": content_type,
+            "timestamp": timestamp,
+            "message_id": message_id,
+            "feedback": [],
+        },
+    )
+
+
+def parse_query_request(
+    data: Dict[str, Any], api_key: str, *, compact: bool = False
+) -> QueryRequest:
+    """Builds the QueryRequest for a decoded query request body.
+
+    If *compact* is True, the conversation is a CompactConversation instead of a list
+    of ProtocolMessages.
+
+    """
+    messages = data.get("query")
+    if (
+        data.get("type") == "query"
+        and type(messages) is list
+        and all(type(data.get(field)) is str for field in _QUERY_STR_FIELDS)
+    ):
+        query = []
+        for message in messages:
+            parsed_message = _construct_message(message, compact)
+            if parsed_message is None:
+                break
+            query.append(parsed_message)
+        else:
+            return _construct(
+                QueryRequest,
+                set(_QUERY_FIELDS_SET),
+                {
+                    "version": data["version"],
+                    "type": "query",
+                    "query": tuple(query) if compact else query,
+                    "user_id": data["user_id"],
+                    "conversation_id": data["conversation_id"],
+                    "message_id": data["message_id"],
+                    "api_key": api_key,
+                },
+            )
+    request = validate(QueryRequest, {**data, "api_key": api_key})
+    if compact:
+        request = request.copy(update={"query": compact_conversation(request.query)})
+    return request
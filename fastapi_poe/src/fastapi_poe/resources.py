@@ -0,0 +1,86 @@
+"""
+
+Registry of objects that a bot shares between requests.
+
+Building API clients, LLM wrappers and chains for every request is slow and prevents
+connection reuse. Bots can instead create them once, usually in PoeBot.on_startup(),
+and register them in PoeBot.resources. Registered resources are closed in reverse
+order when the server shuts down.
+
+"""
+import inspect
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger("uvicorn.default")
+
+
+class ResourceRegistry:
+    """Named objects shared by all requests to a bot.
+
+    Resources are shared by concurrent requests, so they must not keep per-request
+    state. For example, pass LangChain callbacks when calling a model rather than
+    when creating it.
+
+    """
+
+    def __init__(self) -> None:
+        self._resources: Dict[str, Any] = {}
+        self._closers: List[Tuple[Callable[[Any], Any], Any]] = []
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._resources
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self._resources[name]
+        except KeyError:
+            raise KeyError(f"No resource named {name!r} has been registered") from None
+
+    def register(
+        self, name: str, resource: T, *, close: Optional[Callable[[T], Any]] = None
+    ) -> T:
+        """Register *resource* under *name* and return it.
+
+        If *close* is given, it is called with the resource (and awaited, if it
+        returns an awaitable) when the registry is closed, for example
+        close=httpx.AsyncClient.aclose.
+
+        """
+        if name in self._resources:
+            raise ValueError(f"A resource named {name!r} is already registered")
+        self._resources[name] = resource
+        if close is not None:
+            self._closers.append((close, resource))
+        return resource
+
+    def get_or_create(
+        self,
+        name: str,
+        factory: Callable[[], T],
+        *,
+        close: Optional[Callable[[T], Any]] = None,
+    ) -> T:
+        """Return the resource named *name*, creating it with *factory* the first time.
+
+        *factory* is synchronous, so concurrent requests never create two copies.
+
+        """
+        if name in self._resources:
+            return self._resources[name]
+        return self.register(name, factory(), close=close)
+
+    async def aclose(self) -> None:
+        """Close all resources, most recently registered first, and forget them."""
+        closers = self._closers
+        self._closers = []
+        self._resources = {}
+        for close, resource in reversed(closers):
+            try:
+                result = close(resource)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Error while closing a resource")
@@ -0,0 +1,255 @@
+"""
+
+Stores for per-conversation state, such as the chat history a bot keeps itself.
+
+State for a conversation is a list of JSON-serializable entries. Appending an entry
+and looking up a conversation take constant time, and state expires *ttl* seconds
+after the conversation was last updated. If *ttl* is not given, it defaults to the
+context_clear_window_secs of *settings*, so that state is dropped when Poe would clear
+the context anyway.
+
+"""
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+from fastapi_poe.cache import LRUCache
+from fastapi_poe.concurrency import run_sync
+from fastapi_poe.types import SettingsResponse
+
+
+class ConversationStore(ABC):
+    """Base class for stores of per-conversation state."""
+
+    def __init__(
+        self,
+        *,
+        ttl: Optional[float] = None,
+        settings: Optional[SettingsResponse] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        if ttl is None and settings is not None:
+            ttl = settings.context_clear_window_secs
+        self.ttl = ttl
+        # Only the most recent max_entries entries are kept for each conversation
+        self.max_entries = max_entries
+
+    @abstractmethod
+    async def get(
+        self, conversation_id: str, *, last: Optional[int] = None
+    ) -> List[Any]:
+        """Return the entries for *conversation_id*, oldest first.
+
+        If *last* is given, only the last *last* entries are returned, which takes
+        time proportional to *last* rather than to the length of the conversation.
+
+        """
+
+    @abstractmethod
+    async def append(self, conversation_id: str, entry: Any) -> None:
+        """Add *entry* to the state for *conversation_id*."""
+
+    @abstractmethod
+    async def clear(self, conversation_id: str) -> None:
+        """Remove all state for *conversation_id*."""
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Conversation store held in process memory.
+
+    At most *maxsize* conversations are kept; the least recently used ones are evicted
+    first.
+
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        *,
+        ttl: Optional[float] = None,
+        settings: Optional[SettingsResponse] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        super().__init__(ttl=ttl, settings=settings, max_entries=max_entries)
+        self._conversations: LRUCache[str, Deque[Any]] = LRUCache(
+            maxsize=maxsize, ttl=self.ttl
+        )
+
+    async def get(
+        self, conversation_id: str, *, last: Optional[int] = None
+    ) -> List[Any]:
+        entries = self._conversations.get(conversation_id)
+        if entries is None:
+            return []
+        if last is None:
+            return list(entries)
+        recent = list(itertools.islice(reversed(entries), last))
+        recent.reverse()
+        return recent
+
+    async def append(self, conversation_id: str, entry: Any) -> None:
+        entries = self._conversations.get(conversation_id)
+        if entries is None:
+            entries = deque(maxlen=self.max_entries)
+        entries.append(entry)
+        # Setting the entry again renews its TTL
+        self._conversations.set(conversation_id, entries)
+
+    async def clear(self, conversation_id: str) -> None:
+        self._conversations.pop(conversation_id)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversation store kept in a SQLite database at *path*.
+
+    State survives restarts and can be shared by several worker processes on the same
+    machine. Entries are stored as JSON, so tuples are returned as lists. Queries run
+    in worker threads, so a slow disk or a lock held by another process does not
+    block the event loop.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        ttl: Optional[float] = None,
+        settings: Optional[SettingsResponse] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        super().__init__(ttl=ttl, settings=settings, max_entries=max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            # WAL lets other processes read while one of them writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " conversation_id TEXT PRIMARY KEY,"
+                " expires_at REAL,"
+                " next_seq INTEGER NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " conversation_id TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " entry TEXT NOT NULL,"
+                " PRIMARY KEY (conversation_id, seq))"
+            )
+
+    def _delete(self, conversation_id: str) -> None:
+        self._db.execute(
+            "DELETE FROM entries WHERE conversation_id = ?", (conversation_id,)
+        )
+        self._db.execute(
+            "DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        )
+
+    async def get(
+        self, conversation_id: str, *, last: Optional[int] = None
+    ) -> List[Any]:
+        return await run_sync(self._get, conversation_id, last)
+
+    async def append(self, conversation_id: str, entry: Any) -> None:
+        await run_sync(self._append, conversation_id, entry)
+
+    async def clear(self, conversation_id: str) -> None:
+        await run_sync(self._clear, conversation_id)
+
+    def _get(self, conversation_id: str, last: Optional[int]) -> List[Any]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT expires_at FROM conversations WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+            if row is None:
+                return []
+            if row[0] is not None and row[0] <= time.time():
+                self._db.execute("BEGIN IMMEDIATE")
+                self._delete(conversation_id)
+                self._db.execute("COMMIT")
+                return []
+            if last is None:
+                rows = self._db.execute(
+                    "SELECT entry FROM entries WHERE conversation_id = ? ORDER BY seq",
+                    (conversation_id,),
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT entry FROM entries WHERE conversation_id = ?"
+                    " ORDER BY seq DESC LIMIT ?",
+                    (conversation_id, last),
+                ).fetchall()
+                rows.reverse()
+        return [json.loads(entry) for (entry,) in rows]
+
+    def _append(self, conversation_id: str, entry: Any) -> None:
+        serialized = json.dumps(entry)
+        now = time.time()
+        expires_at = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT expires_at, next_seq FROM conversations"
+                    " WHERE conversation_id = ?",
+                    (conversation_id,),
+                ).fetchone()
+                if row is not None and row[0] is not None and row[0] <= now:
+                    self._delete(conversation_id)
+                    row = None
+                seq = 0 if row is None else row[1]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                    (conversation_id, expires_at, seq + 1),
+                )
+                self._db.execute(
+                    "INSERT INTO entries VALUES (?, ?, ?)",
+                    (conversation_id, seq, serialized),
+                )
+                if self.max_entries is not None and seq >= self.max_entries:
+                    self._db.execute(
+                        "DELETE FROM entries WHERE conversation_id = ? AND seq <= ?",
+                        (conversation_id, seq - self.max_entries),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _clear(self, conversation_id: str) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._delete(conversation_id)
+            self._db.execute("COMMIT")
+
+    def purge_expired(self) -> int:
+        """Delete all expired conversations and return how many were deleted.
+
+        This blocks, so call it with run_sync() from async code.
+
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            expired = [
+                conversation_id
+                for (conversation_id,) in self._db.execute(
+                    "SELECT conversation_id FROM conversations WHERE expires_at <= ?",
+                    (time.time(),),
+                )
+            ]
+            for conversation_id in expired:
+                self._delete(conversation_id)
+            self._db.execute("COMMIT")
+        return len(expired)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
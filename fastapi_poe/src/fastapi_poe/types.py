@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
 from pydantic import BaseModel, Field
 from typing_extensions import Literal, TypeAlias
@@ -36,7 +36,9 @@ class BaseRequest(BaseModel):
 class QueryRequest(BaseRequest):
     """Request parameters for a query request."""
 
-    query: List[ProtocolMessage]
+    # A list, unless the bot sets compact_conversations; then it is a tuple of
+    # CompactMessages, which have the same attributes but are not pydantic models
+    query: Sequence[ProtocolMessage]
     user_id: Identifier
     conversation_id: Identifier
     message_id: Identifier
@@ -1 +1,5 @@
 from .poe import LangChainCatBot as LangChainCatBot  # noqa: F401
+from .streaming import (  # noqa: F401
+    LangChainChatBot as LangChainChatBot,
+    stream_chat as stream_chat,
+)
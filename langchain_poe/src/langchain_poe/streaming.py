@@ -0,0 +1,127 @@
+"""
+
+Streaming replies from LangChain chat models to Poe.
+
+stream_chat() runs the generation in a task that it owns: tokens are yielded as the
+model produces them, errors from the model are raised to the caller, and the
+generation is cancelled as soon as the caller stops iterating, for example because
+the client disconnected. LangChainChatBot builds a PoeBot on top of it.
+
+"""
+import asyncio
+import contextlib
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, List, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from sse_starlette.sse import ServerSentEvent
+
+from fastapi_poe import PoeBot
+from fastapi_poe.types import QueryRequest
+
+logger = logging.getLogger("uvicorn.default")
+
+
+class _TokenQueue(AsyncCallbackHandler):
+    """Callback handler that puts new tokens on a queue."""
+
+    def __init__(self) -> None:
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue()
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.queue.put_nowait(token)
+
+
+async def stream_chat(
+    chat: BaseChatModel, messages: List[BaseMessage], **kwargs: Any
+) -> AsyncIterator[str]:
+    """Yield the tokens of *chat*'s reply to *messages* as they are generated.
+
+    If the model does not stream, its whole reply is yielded at the end. Exceptions
+    from the model are raised here. The generation is cancelled when the iterator is
+    closed before it finishes. Extra keyword arguments are passed to agenerate().
+
+    """
+    handler = _TokenQueue()
+    generation = asyncio.ensure_future(
+        chat.agenerate([messages], callbacks=[handler], **kwargs)
+    )
+    next_token: "Optional[asyncio.Future[str]]" = None
+    streamed = False
+    try:
+        while True:
+            next_token = asyncio.ensure_future(handler.queue.get())
+            await asyncio.wait(
+                {next_token, generation}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_token.done():
+                streamed = True
+                yield next_token.result()
+                continue
+            next_token.cancel()
+            next_token = None
+            break
+        # Tokens may arrive just before the generation finishes
+        while not handler.queue.empty():
+            streamed = True
+            yield handler.queue.get_nowait()
+        result = generation.result()
+        if not streamed:
+            yield result.generations[0][0].text
+    finally:
+        if next_token is not None:
+            next_token.cancel()
+        if not generation.done():
+            generation.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await generation
+
+
+class LangChainChatBot(PoeBot, ABC):
+    """PoeBot that streams replies from a LangChain chat model.
+
+    Override create_chat_model(). The model is created once and shared by all
+    requests, so it must not be given per-request callbacks. Errors from the model
+    are sent to the user as error events.
+
+    """
+
+    # Tokens arrive one at a time, so send them in fewer, larger events
+    coalesce_text_events = True
+
+    # If set, sent to the model as a system message before the conversation
+    system_prompt: Optional[str] = None
+
+    # Whether the user may retry after the model fails
+    allow_retry_on_error: bool = True
+
+    @abstractmethod
+    def create_chat_model(self) -> BaseChatModel:
+        """Override this to create the chat model."""
+
+    @property
+    def chat_model(self) -> BaseChatModel:
+        return self.resources.get_or_create("chat_model", self.create_chat_model)
+
+    def get_messages(self, query: QueryRequest) -> List[BaseMessage]:
+        """Convert the conversation to LangChain messages."""
+        messages: List[BaseMessage] = []
+        if self.system_prompt is not None:
+            messages.append(SystemMessage(content=self.system_prompt))
+        for message in query.query:
+            if message.role == "bot":
+                messages.append(AIMessage(content=message.content))
+            elif message.role == "user":
+                messages.append(HumanMessage(content=message.content))
+        return messages
+
+    async def get_response(self, query: QueryRequest) -> AsyncIterator[ServerSentEvent]:
+        try:
+            async for token in stream_chat(self.chat_model, self.get_messages(query)):
+                yield self.text_event(token)
+        except Exception as e:
+            logger.exception("Error from the chat model")
+            yield self.error_event(repr(e), allow_retry=self.allow_retry_on_error)
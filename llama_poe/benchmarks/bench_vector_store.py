@@ -0,0 +1,78 @@
+"""
+Benchmark for retrieval from the SimpleVectorStore and the NumpyVectorStore.
+
+Fills each store with random 1536-dimensional embeddings (the size of OpenAI's
+embeddings) and measures the time to add them and the average time of a top-3
+query, for 1,000, 10,000 and 50,000 embeddings. For the NumpyVectorStore, it also
+reports the memory taken by the embeddings with each dtype.
+
+Run with: python benchmarks/bench_vector_store.py
+"""
+from __future__ import annotations
+
+import time
+from typing import Any
+
+import numpy as np
+from llama_index.vector_stores.simple import SimpleVectorStore
+from llama_index.vector_stores.types import NodeEmbeddingResult, VectorStoreQuery
+from poe_api.vector_store import NumpyVectorStore
+
+DIM = 1536
+TOP_K = 3
+
+
+def _make_results(num_embeddings: int) -> list[NodeEmbeddingResult]:
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((num_embeddings, DIM), dtype=np.float32)
+    return [
+        NodeEmbeddingResult(
+            id=f"node-{i}",
+            node=None,  # type: ignore[arg-type]
+            embedding=embedding.tolist(),
+            doc_id=f"doc-{i // 10}",
+        )
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+def _measure(store: Any, results: list[NodeEmbeddingResult], num_queries: int) -> str:
+    begin = time.perf_counter()
+    # Add in batches, as ingestion does
+    for start in range(0, len(results), 64):
+        stop = start + 64
+        store.add(results[start:stop])
+    add_secs = time.perf_counter() - begin
+    rng = np.random.default_rng(1)
+    queries = [
+        VectorStoreQuery(
+            query_embedding=rng.standard_normal(DIM).tolist(), similarity_top_k=TOP_K
+        )
+        for _ in range(num_queries)
+    ]
+    start = time.perf_counter()
+    for query in queries:
+        store.query(query)
+    query_ms = (time.perf_counter() - start) / num_queries * 1000
+    return f"add {add_secs:6.2f}s, query {query_ms:8.2f}ms"
+
+
+def main() -> None:
+    for num_embeddings in (1_000, 10_000, 50_000):
+        results = _make_results(num_embeddings)
+        print(f"{num_embeddings:,} embeddings:")
+        print(
+            f"  SimpleVectorStore:          {_measure(SimpleVectorStore(), results, 3)}"
+        )
+        for dtype in ("float32", "float16", "int8"):
+            store = NumpyVectorStore(dtype=dtype)
+            timings = _measure(store, results, 20)
+            megabytes = store.embeddings.nbytes / 2**20
+            print(
+                f"  NumpyVectorStore {dtype:>7}:  {timings}, embeddings"
+                f" {megabytes:,.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Incrementally rendered chat history.
+"""
+from __future__ import annotations
+
+import itertools
+from collections import deque
+from typing import Callable, Sequence
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens in text (about 4 characters each)."""
+    return (len(text) + 3) // 4
+
+
+class ChatHistoryBuffer:
+    """Chat history rendered for the condense-question prompt, one turn at a time.
+
+    Each turn is rendered once, when it is added. If max_tokens is set, the oldest
+    turns are dropped so that the rendered history stays within that many tokens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        # Number of turns added so far, including any that were dropped
+        self.num_turns = 0
+        self._turns: deque[tuple[str, int]] = deque()
+        self._num_tokens = 0
+        self._rendered: str | None = ""
+
+    def add_turn(self, human: str, ai: str) -> None:
+        rendered = "\nHuman: " + human + "\nAssistant: " + ai
+        num_tokens = self.count_tokens(rendered)
+        self._turns.append((rendered, num_tokens))
+        self._num_tokens += num_tokens
+        self.num_turns += 1
+        if self.max_tokens is not None:
+            while self._turns and self._num_tokens > self.max_tokens:
+                _, dropped_tokens = self._turns.popleft()
+                self._num_tokens -= dropped_tokens
+        self._rendered = None
+
+    def add_new_turns(self, turns: Sequence[Sequence[str]]) -> None:
+        """Add the turns of the full history in turns that were not added yet."""
+        for human, ai in itertools.islice(turns, self.num_turns, None):
+            self.add_turn(human, ai)
+
+    def render(self) -> str:
+        if self._rendered is None:
+            self._rendered = "".join(rendered for rendered, _ in self._turns)
+        return self._rendered
@@ -0,0 +1,165 @@
+"""
+Binary on-disk format for vector indices.
+
+Loading an index saved with save_to_disk() parses one JSON file that holds every
+embedding as a list of numbers, so startup takes longer the larger the corpus. In
+this format, an index is a directory:
+
+- embeddings.npy: the embeddings as a matrix, which is memory-mapped, so loading
+  does not read it. norms.npy and, for int8 embeddings, scales.npy hold the norm and
+  scale of each row.
+- index.json: the vector ids of the matrix rows and the index struct.
+- docstore.json: the nodes and their text, parsed the first time they are needed.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Any, Callable
+
+import numpy as np
+from llama_index.docstore.simple_docstore import SimpleDocumentStore
+from llama_index.indices.base import BaseGPTIndex
+from llama_index.indices.registry import load_index_struct_from_dict
+from llama_index.indices.vector_store.base import GPTVectorStoreIndex
+from llama_index.vector_stores.simple import SimpleVectorStore
+from poe_api.vector_store import NumpyVectorStore
+
+FORMAT_VERSION = 1
+
+EMBEDDINGS_FILE = "embeddings.npy"
+NORMS_FILE = "norms.npy"
+SCALES_FILE = "scales.npy"
+INDEX_FILE = "index.json"
+DOCSTORE_FILE = "docstore.json"
+
+
+class LazyDocumentStore(SimpleDocumentStore):
+    """SimpleDocumentStore that calls load() for its contents when first used."""
+
+    def __init__(self, load: Callable[[], SimpleDocumentStore]) -> None:
+        # SimpleDocumentStore.__init__ is not called, it would set _docs
+        self._load = load
+        self._lock = threading.Lock()
+        self._loaded: SimpleDocumentStore | None = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded is not None
+
+    def ensure_loaded(self) -> SimpleDocumentStore:
+        """Load the documents now, if that has not happened yet."""
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self._loaded = self._load()
+        return self._loaded
+
+    @property  # type: ignore[override]
+    def _docs(self) -> dict[str, Any]:
+        return self.ensure_loaded()._docs
+
+    @property  # type: ignore[override]
+    def _ref_doc_info(self) -> dict[str, dict[str, Any]]:
+        return self.ensure_loaded()._ref_doc_info
+
+
+def _get_vector_store(index: BaseGPTIndex) -> Any:
+    return index.query_context.get("vector_store")
+
+
+def supports_binary_format(index: BaseGPTIndex) -> bool:
+    """Whether save_index() can save index."""
+    return (
+        isinstance(index, GPTVectorStoreIndex)
+        and isinstance(_get_vector_store(index), (SimpleVectorStore, NumpyVectorStore))
+        and isinstance(index.docstore, SimpleDocumentStore)
+    )
+
+
+def is_binary_index(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def save_index(index: BaseGPTIndex, path: str) -> None:
+    """Save index to a new directory at path."""
+    if not supports_binary_format(index):
+        raise ValueError(f"Cannot save {type(index).__name__} in the binary format")
+    vector_store = _get_vector_store(index)
+    if isinstance(vector_store, SimpleVectorStore):
+        vector_store = NumpyVectorStore.from_dict(vector_store.config_dict)
+    os.makedirs(path)
+    np.save(os.path.join(path, EMBEDDINGS_FILE), vector_store.embeddings)
+    np.save(os.path.join(path, NORMS_FILE), vector_store.norms)
+    if vector_store.scales is not None:
+        np.save(os.path.join(path, SCALES_FILE), vector_store.scales)
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "ids": vector_store.ids,
+        "doc_ids": vector_store.doc_ids,
+        "index_struct": index.index_struct.to_dict(),
+    }
+    with open(os.path.join(path, INDEX_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    with open(os.path.join(path, DOCSTORE_FILE), "w", encoding="utf-8") as f:
+        json.dump(index.docstore.to_dict(), f)
+
+
+def _load_docstore(path: str) -> SimpleDocumentStore:
+    with open(os.path.join(path, DOCSTORE_FILE), encoding="utf-8") as f:
+        return SimpleDocumentStore.from_dict(json.load(f))
+
+
+def _load_array(path: str) -> np.ndarray | None:
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def load_index(
+    index_cls: type[GPTVectorStoreIndex], path: str, **kwargs: Any
+) -> GPTVectorStoreIndex:
+    """Load an index saved with save_index().
+
+    The embeddings are memory-mapped and the docstore is a LazyDocumentStore.
+    """
+    with open(os.path.join(path, INDEX_FILE), encoding="utf-8") as f:
+        metadata = json.load(f)
+    if metadata["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format: {metadata['format_version']}")
+    vector_store = NumpyVectorStore(
+        _load_array(os.path.join(path, EMBEDDINGS_FILE)),
+        metadata["ids"],
+        metadata["doc_ids"],
+        scales=_load_array(os.path.join(path, SCALES_FILE)),
+        norms=_load_array(os.path.join(path, NORMS_FILE)),
+    )
+    return index_cls(
+        index_struct=load_index_struct_from_dict(metadata["index_struct"]),
+        docstore=LazyDocumentStore(lambda: _load_docstore(path)),
+        vector_store=vector_store,
+        **kwargs,
+    )
+
+
+def use_numpy_vector_store(index: BaseGPTIndex, dtype: str = "float32") -> BaseGPTIndex:
+    """Return index with its embeddings in a NumpyVectorStore of the given dtype.
+
+    Indices with other vector stores than SimpleVectorStore are returned as they are.
+    """
+    vector_store = _get_vector_store(index)
+    if isinstance(vector_store, NumpyVectorStore):
+        if vector_store.dtype == dtype:
+            return index
+        vector_store = vector_store.astype(dtype)
+    elif isinstance(vector_store, SimpleVectorStore):
+        vector_store = NumpyVectorStore.from_dict(vector_store.config_dict, dtype)
+    else:
+        return index
+    return type(index)(
+        index_struct=index.index_struct,
+        docstore=index.docstore,
+        service_context=index.service_context,
+        vector_store=vector_store,
+    )
@@ -0,0 +1,220 @@
+"""
+Background ingestion of documents in batches.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Generic, List, Tuple, TypeVar
+
+from poe_api.types import Document
+
+from fastapi_poe.cache import LRUCache
+from fastapi_poe.concurrency import run_sync
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestionJob:
+    """Status of the documents from one add_documents request."""
+
+    job_id: str
+    num_documents: int
+    # Documents whose doc_id and content had already been ingested
+    num_skipped: int = 0
+    # One of "queued", "running", "done" or "failed"
+    status: str = "queued"
+    error: str | None = None
+
+    def dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def content_hash(document: Document) -> str:
+    return hashlib.sha256(document.text.encode("utf-8")).hexdigest()
+
+
+_Batch = List[Tuple[IngestionJob, List[Document]]]
+
+
+def _latest_documents(batch: _Batch) -> list[Document]:
+    """The documents in batch, keeping only the last submitted version of each."""
+    latest: dict[str, Document] = {}
+    for _, documents in batch:
+        for document in documents:
+            latest[document.doc_id] = document
+    return list(latest.values())
+
+
+class IngestionQueue(Generic[T]):
+    """Queue that ingests documents from many requests in batches.
+
+    Queued documents are grouped into batches of about batch_size documents, waiting
+    at most batch_wait_secs for more to arrive. Each batch is passed to prepare in a
+    worker thread (for example to parse and embed it), and the result is passed to
+    the coroutine function commit on the event loop. Up to num_workers batches are
+    prepared at once, but batches are committed one at a time in the order they were
+    submitted, so an older version of a document never replaces a newer one.
+    Documents whose doc_id and content hash were already submitted are skipped; the
+    hashes of the max_tracked_documents most recently submitted documents are kept.
+    """
+
+    def __init__(
+        self,
+        prepare: Callable[[list[Document]], T],
+        commit: Callable[[T], Awaitable[None]],
+        *,
+        batch_size: int = 64,
+        batch_wait_secs: float = 0.5,
+        num_workers: int = 2,
+        max_jobs: int = 10_000,
+        max_tracked_documents: int = 100_000,
+    ) -> None:
+        self.prepare = prepare
+        self.commit = commit
+        self.batch_size = batch_size
+        self.batch_wait_secs = batch_wait_secs
+        self.num_workers = num_workers
+        self._jobs: LRUCache[str, IngestionJob] = LRUCache(maxsize=max_jobs)
+        # Content hash of the latest submitted version of each document
+        self._content_hashes: LRUCache[str, str] = LRUCache(
+            maxsize=max_tracked_documents
+        )
+        self._queue: asyncio.Queue[tuple[IngestionJob, list[Document]]] | None = None
+        # Batches whose preparation has started, in submission order
+        self._prepared: asyncio.Queue[tuple[_Batch, asyncio.Future[T]]] | None = None
+        self._prepare_slots: asyncio.Semaphore | None = None
+        self._workers: list[asyncio.Task[None]] = []
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._prepared = asyncio.Queue()
+        self._prepare_slots = asyncio.Semaphore(self.num_workers)
+        self._workers = [
+            asyncio.ensure_future(self._run_batcher()),
+            asyncio.ensure_future(self._run_committer()),
+        ]
+
+    async def stop(self) -> None:
+        """Finish the queued jobs, then stop the workers."""
+        if self._queue is not None:
+            await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, documents: list[Document]) -> IngestionJob:
+        """Queue documents for ingestion and return their job right away."""
+        assert self._queue is not None, "start() has not been called"
+        new_documents = {}
+        for document in documents:
+            digest = content_hash(document)
+            if self._content_hashes.get(document.doc_id) != digest:
+                # Later copies in the same request replace earlier ones
+                new_documents[document.doc_id] = (document, digest)
+        job = IngestionJob(
+            job_id=uuid.uuid4().hex,
+            num_documents=len(documents),
+            num_skipped=len(documents) - len(new_documents),
+        )
+        self._jobs.set(job.job_id, job)
+        if not new_documents:
+            job.status = "done"
+            return job
+        for doc_id, (_, digest) in new_documents.items():
+            self._content_hashes.set(doc_id, digest)
+        self._queue.put_nowait(
+            (job, [document for document, _ in new_documents.values()])
+        )
+        return job
+
+    def get_job(self, job_id: str) -> IngestionJob | None:
+        return self._jobs.get(job_id)
+
+    async def _next_batch(self, first: tuple[IngestionJob, list[Document]]) -> _Batch:
+        assert self._queue is not None
+        batch = [first]
+        num_documents = len(batch[0][1])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait_secs
+        while num_documents < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            num_documents += len(item[1])
+        return batch
+
+    async def _prepare(self, documents: list[Document]) -> T:
+        assert self._prepare_slots is not None
+        try:
+            return await run_sync(self.prepare, documents)
+        finally:
+            self._prepare_slots.release()
+
+    async def _run_batcher(self) -> None:
+        """Form batches in submission order and start preparing them."""
+        assert self._prepared is not None and self._prepare_slots is not None
+        assert self._queue is not None
+        while True:
+            first = await self._queue.get()
+            # Wait for a free worker before collecting the rest of the batch, so
+            # that batches grow while all workers are busy
+            await self._prepare_slots.acquire()
+            try:
+                batch = await self._next_batch(first)
+            except BaseException:
+                self._prepare_slots.release()
+                raise
+            for job, _ in batch:
+                job.status = "running"
+            prepared = asyncio.ensure_future(self._prepare(_latest_documents(batch)))
+            self._prepared.put_nowait((batch, prepared))
+
+    async def _run_committer(self) -> None:
+        """Commit the prepared batches one at a time, in submission order."""
+        assert self._queue is not None and self._prepared is not None
+        while True:
+            batch, prepared = await self._prepared.get()
+            try:
+                await self._commit(batch, prepared)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit(self, batch: _Batch, prepared: Awaitable[T]) -> None:
+        documents = _latest_documents(batch)
+        try:
+            await self.commit(await prepared)
+        except Exception as ex:
+            if len(batch) > 1:
+                # Retry the jobs one at a time and in order, so one bad request
+                # fails on its own
+                assert self._prepare_slots is not None
+                for item in batch:
+                    await self._prepare_slots.acquire()
+                    await self._commit([item], self._prepare(item[1]))
+                return
+            logger.exception(f"Failed to ingest {len(documents)} documents")
+            for document in documents:
+                # Let the documents be submitted again, unless they changed since
+                if self._content_hashes.get(document.doc_id) == content_hash(document):
+                    self._content_hashes.pop(document.doc_id)
+            job = batch[0][0]
+            job.status = "failed"
+            job.error = repr(ex)
+        else:
+            logger.info(f"Ingested {len(documents)} documents")
+            for job, _ in batch:
+                job.status = "done"
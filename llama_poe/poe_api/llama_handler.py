@@ -3,21 +3,49 @@ LlamaIndex Bot.
 """
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import logging
 import os
-from typing import AsyncIterable, Sequence
+import threading
+import time
+from typing import Any, AsyncIterable, Sequence
 
 from fastapi.responses import JSONResponse
 from langchain import LLMChain, OpenAI
 from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
 from llama_index import Document as LlamaDocument, IndexStructType
+from llama_index.data_structs.node_v2 import Node
 from llama_index.indices.base import BaseGPTIndex
+from llama_index.indices.query.schema import QueryBundle
 from llama_index.indices.registry import INDEX_STRUCT_TYPE_TO_INDEX_CLASS
+from llama_index.indices.vector_store.base import GPTVectorStoreIndex
 from llama_index.readers import SimpleDirectoryReader
+from llama_index.response.schema import RESPONSE_TYPE
+from llama_index.vector_stores.types import VectorStoreQuery
+from poe_api.chat_history import ChatHistoryBuffer
+from poe_api.index_store import (
+    LazyDocumentStore,
+    is_binary_index,
+    load_index,
+    save_index,
+    supports_binary_format,
+    use_numpy_vector_store,
+)
+from poe_api.ingestion import IngestionJob, IngestionQueue
+from poe_api.persistence import IndexPersistence
 from poe_api.types import AddDocumentsRequest, Document
+from poe_api.vector_store import NumpyVectorStore
 from sse_starlette.sse import ServerSentEvent
 
 from fastapi_poe.base import PoeBot
+from fastapi_poe.cache import LRUCache
+from fastapi_poe.concurrency import iterate_in_thread, run_sync
+from fastapi_poe.state import (
+    ConversationStore,
+    InMemoryConversationStore,
+    SQLiteConversationStore,
+)
 from fastapi_poe.types import (
     QueryRequest,
     ReportFeedbackRequest,
@@ -32,6 +60,27 @@ INDEX_STRUCT_TYPE_STR = os.environ.get(
     "LLAMA_INDEX_TYPE", IndexStructType.SIMPLE_DICT.value
 )
 INDEX_JSON_PATH = os.environ.get("LLAMA_INDEX_JSON_PATH", "save/index.json")
+# Embeddings of vector indices are stored as float32, float16 or int8
+VECTOR_DTYPE = os.environ.get("LLAMA_VECTOR_DTYPE", "float32")
+# If set, chat history is kept in this SQLite database instead of in memory
+CHAT_HISTORY_DB_PATH = os.environ.get("LLAMA_CHAT_HISTORY_DB_PATH")
+# The index is saved this often if documents were added since the last snapshot
+SNAPSHOT_INTERVAL_SECS = float(os.environ.get("LLAMA_SNAPSHOT_INTERVAL_SECS", 300))
+# Documents from /add_document requests are ingested in batches of about this size
+INGESTION_BATCH_SIZE = int(os.environ.get("LLAMA_INGESTION_BATCH_SIZE", 64))
+INGESTION_WORKERS = int(os.environ.get("LLAMA_INGESTION_WORKERS", 2))
+# Older turns are left out of the condense-question prompt beyond this many tokens
+CHAT_HISTORY_MAX_TOKENS = int(os.environ.get("LLAMA_CHAT_HISTORY_MAX_TOKENS", 2000))
+# How to turn the last message into the question to query the index with:
+# - "always_condense": ask the LLM to rephrase it as a standalone question, given the
+#   chat history.
+# - "smart": the same, but use the message as it is when there is no chat history.
+# - "speculative": like "smart", but also retrieve for the message as it is while
+#   the LLM rephrases it, and use that if the LLM returns the message unchanged.
+QUERY_PIPELINE = os.environ.get("LLAMA_QUERY_PIPELINE", "smart")
+SIMILARITY_TOP_K = 3
+# Number of condensed questions, query embeddings and retrieval results to cache
+QUERY_CACHE_SIZE = int(os.environ.get("LLAMA_QUERY_CACHE_SIZE", 1024))
 
 EXTERNAL_VECTOR_STORE_INDEX_STRUCT_TYPES = [
     IndexStructType.DICT,
@@ -57,9 +106,16 @@ def _create_or_load_index(
     index_type_str: str | None = None,
     index_json_path: str | None = None,
     index_type_to_index_cls: dict[str, type[BaseGPTIndex]] | None = None,
+    persistence: IndexPersistence | None = None,
 ) -> BaseGPTIndex:
-    """Create or load index from json path."""
+    """Create or load index from json path.
+
+    If persistence is given, the index is loaded from its latest snapshot and the
+    documents logged since then are inserted again.
+    """
     index_json_path = index_json_path or INDEX_JSON_PATH
+    if persistence is not None:
+        index_json_path = persistence.snapshot_path or index_json_path
     index_type_to_index_cls = (
         index_type_to_index_cls or INDEX_STRUCT_TYPE_TO_INDEX_CLASS
     )
@@ -74,14 +130,22 @@ def _create_or_load_index(
         raise ValueError("Please use vector store directly.")
 
     index_cls = index_type_to_index_cls[index_type]
+    start = time.perf_counter()
     try:
         # Load index from disk
-        index = index_cls.load_from_disk(index_json_path)
-        logger.info(f"Loading index from {index_json_path}")
-        return index
+        if is_binary_index(index_json_path):
+            index = load_index(index_cls, index_json_path)
+        else:
+            index = index_cls.load_from_disk(index_json_path)
+        # Keep the embeddings in a NumPy matrix for fast retrieval
+        index = use_numpy_vector_store(index, VECTOR_DTYPE)
+        logger.info(
+            f"Loaded index from {index_json_path} in"
+            f" {time.perf_counter() - start:.2f}s"
+        )
     except OSError:
         # Create empty index
-        index = index_cls(nodes=[])
+        index = use_numpy_vector_store(index_cls(nodes=[]), VECTOR_DTYPE)
         logger.info("Creating new index")
 
         if LOAD_DATA:
@@ -93,58 +157,205 @@ def _create_or_load_index(
             )
             index.insert_nodes(nodes)
 
-        return index
+    if persistence is not None:
+        # Documents in the snapshot or in earlier batches, which logged batches
+        # replace. Without a doc_id_dict, every replayed document is deleted first.
+        doc_id_dict = getattr(index.index_struct, "doc_id_dict", None)
+        indexed_doc_ids = None if doc_id_dict is None else set(doc_id_dict)
+        for docs in persistence.replay():
+            for doc in docs:
+                if indexed_doc_ids is None or doc.doc_id in indexed_doc_ids:
+                    index.delete(doc.doc_id)
+            nodes = index.service_context.node_parser.get_nodes_from_documents(
+                _to_llama_documents(docs)
+            )
+            index.insert_nodes(nodes)
+            if indexed_doc_ids is not None:
+                indexed_doc_ids.update(doc.doc_id for doc in docs)
+        if persistence.num_logged_batches:
+            logger.info(f"Replayed {persistence.num_logged_batches} logged batches")
+
+    return index
 
 
-def _get_chat_history(chat_history: list[tuple[str, str]]) -> str:
-    buffer = ""
-    for human_s, ai_s in chat_history:
-        human = "Human: " + human_s
-        ai = "Assistant: " + ai_s
-        buffer += "\n" + "\n".join([human, ai])
-    return buffer
+def _create_chat_history_store() -> ConversationStore:
+    """Create the store for chat history, which expires with the context window."""
+    if CHAT_HISTORY_DB_PATH:
+        return SQLiteConversationStore(CHAT_HISTORY_DB_PATH, settings=SETTINGS)
+    return InMemoryConversationStore(settings=SETTINGS)
 
 
 class LlamaBot(PoeBot):
     def __init__(self) -> None:
         """Setup LlamaIndex."""
-        self._chat_history = {}
-        self._index = _create_or_load_index()
+        self._chat_history = _create_chat_history_store()
+        # Rendered chat history per conversation, so each turn is only rendered once
+        self._history_buffers: LRUCache[str, ChatHistoryBuffer] = LRUCache(
+            maxsize=10_000, ttl=SETTINGS.context_clear_window_secs
+        )
+        self._persistence = IndexPersistence(INDEX_JSON_PATH)
+        self._index = _create_or_load_index(persistence=self._persistence)
+        # Held while the index is changed or saved. Created in on_startup(), so
+        # that it belongs to the server's event loop.
+        self._index_lock: asyncio.Lock | None = None
+        self._snapshot_task: asyncio.Task[None] | None = None
+        self._preload_task: asyncio.Task[None] | None = None
+        self._ingestion = IngestionQueue(
+            self._prepare_nodes,
+            self._insert_nodes,
+            batch_size=INGESTION_BATCH_SIZE,
+            num_workers=INGESTION_WORKERS,
+        )
+        # The embedding model queues texts internally, so workers take turns using it
+        self._embed_lock = threading.Lock()
+        # Worker threads hold this while they query or change the index, so that a
+        # query never sees nodes that are only partly inserted or deleted
+        self._index_thread_lock = threading.Lock()
+        # Documents in the index, whose old nodes are deleted when they are added again
+        self._inserted_doc_ids: set[str] = set(
+            getattr(self._index.index_struct, "doc_id_dict", ())
+        )
+        # Standalone questions by chat history and message, and their embeddings.
+        # Neither depends on the index, unlike the retrieval results, which the
+        # vector store caches and clears whenever documents are added.
+        self._question_cache: LRUCache[tuple[str, str], str] = LRUCache(
+            maxsize=QUERY_CACHE_SIZE
+        )
+        self._embedding_cache: LRUCache[str, list[float]] = LRUCache(
+            maxsize=QUERY_CACHE_SIZE
+        )
+        vector_store = self._index.query_context.get("vector_store")
+        if isinstance(vector_store, NumpyVectorStore):
+            vector_store.query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+
+    def _get_history_buffer(
+        self, conversation_id: str, chat_history: list[Any]
+    ) -> ChatHistoryBuffer:
+        """Return the rendered history, updated with turns it has not seen yet."""
+        buffer = self._history_buffers.get(conversation_id)
+        if buffer is None or buffer.num_turns > len(chat_history):
+            # New conversation, or the stored history was cleared or expired
+            buffer = ChatHistoryBuffer(max_tokens=CHAT_HISTORY_MAX_TOKENS)
+        # Other workers may have added turns to a shared store
+        buffer.add_new_turns(chat_history)
+        self._history_buffers.set(conversation_id, buffer)
+        return buffer
+
+    async def on_startup(self) -> None:
+        """Start ingestion and create the LLM chains shared by all requests."""
+        self._index_lock = asyncio.Lock()
+        self._ingestion.start()
+        self._snapshot_task = asyncio.ensure_future(self._save_snapshots())
+        docstore = self._index.docstore
+        if isinstance(docstore, LazyDocumentStore):
+            # Parse the nodes in the background, so the first query is not slowed down
+            self._preload_task = asyncio.ensure_future(self._preload_docstore(docstore))
+        question_gen_model = OpenAI(temperature=0)
+        self.resources.register(
+            "question_generator",
+            LLMChain(llm=question_gen_model, prompt=CONDENSE_QUESTION_PROMPT),
+        )
 
     async def get_response(self, query: QueryRequest) -> AsyncIterable[ServerSentEvent]:
         """Return an async iterator of events to send to the user."""
         # Get chat history
-        chat_history = self._chat_history.get(query.conversation_id)
-        if chat_history is None:
-            chat_history = []
-            self._chat_history[query.conversation_id] = chat_history
+        chat_history = await self._chat_history.get(query.conversation_id)
 
         # Get last message
         last_message = query.query[-1].content
 
         # Generate standalone question from conversation context and last message
-        question_gen_model = OpenAI(temperature=0)
-        question_generator = LLMChain(
-            llm=question_gen_model, prompt=CONDENSE_QUESTION_PROMPT
-        )
-
-        chat_history_str = _get_chat_history(chat_history)
+        chat_history_str = self._get_history_buffer(
+            query.conversation_id, chat_history
+        ).render()
         logger.debug(chat_history_str)
-        new_question = question_generator.run(
-            question=last_message, chat_history=chat_history_str
+        query_bundle = await self._get_standalone_query(
+            chat_history_str, last_message, has_history=bool(chat_history)
         )
-        logger.info(f"Querying with: {new_question}")
+        logger.info(f"Querying with: {query_bundle.query_str}")
 
         # Query with standalone question
-        response = await self._index.aquery(
-            new_question, streaming=True, similarity_top_k=3
-        )
-        full_response = ""
-        for text in response.response_gen:
-            full_response += text
+        response = await run_sync(self._query_index, query_bundle)
+        response_chunks = []
+        async for text in iterate_in_thread(response.response_gen):
+            response_chunks.append(text)
             yield self.text_event(text)
 
-        chat_history.append((last_message, full_response))
+        await self._chat_history.append(
+            query.conversation_id, (last_message, "".join(response_chunks))
+        )
+
+    async def _get_standalone_query(
+        self, chat_history: str, message: str, *, has_history: bool
+    ) -> QueryBundle:
+        """Return the query for message, as configured by QUERY_PIPELINE."""
+        if not has_history and QUERY_PIPELINE != "always_condense":
+            # There is nothing to condense, so skip the LLM round trip
+            return await self._get_query_bundle(message)
+        if QUERY_PIPELINE != "speculative":
+            question = await self._condense_question(chat_history, message)
+            return await self._get_query_bundle(question)
+        # Follow-up messages are often standalone already, so retrieve for the
+        # message while the LLM condenses it
+        speculative = asyncio.ensure_future(self._retrieve(message))
+        # Its errors only matter if it is used
+        speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            question = await self._condense_question(chat_history, message)
+        except BaseException:
+            speculative.cancel()
+            raise
+        if question.strip() == message.strip():
+            return await speculative
+        speculative.cancel()
+        return await self._get_query_bundle(question)
+
+    async def _retrieve(self, question: str) -> QueryBundle:
+        """Embed question and retrieve its nodes, so that querying hits the caches."""
+        query_bundle = await self._get_query_bundle(question)
+        vector_store = self._index.query_context.get("vector_store")
+        if isinstance(vector_store, NumpyVectorStore) and query_bundle.embedding:
+            # The similarity scan would otherwise block other streams
+            await run_sync(
+                vector_store.query,
+                VectorStoreQuery(
+                    query_embedding=query_bundle.embedding,
+                    similarity_top_k=SIMILARITY_TOP_K,
+                ),
+            )
+        return query_bundle
+
+    def _query_index(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        """Retrieve nodes for query_bundle and start streaming the answer."""
+        with self._index_thread_lock:
+            return self._index.query(
+                query_bundle, streaming=True, similarity_top_k=SIMILARITY_TOP_K
+            )
+
+    async def _condense_question(self, chat_history: str, message: str) -> str:
+        """Rephrase message as a standalone question, given the chat history."""
+        key = (chat_history, message)
+        question = self._question_cache.get(key)
+        if question is None:
+            question_generator = self.resources["question_generator"]
+            # The LLM call is synchronous, so keep it off the event loop
+            question = await run_sync(
+                question_generator.run, question=message, chat_history=chat_history
+            )
+            self._question_cache.set(key, question)
+        return question
+
+    async def _get_query_bundle(self, question: str) -> QueryBundle:
+        """Return the query for question, with its embedding for vector indices."""
+        if not isinstance(self._index, GPTVectorStoreIndex):
+            return QueryBundle(question)
+        embedding = self._embedding_cache.get(question)
+        if embedding is None:
+            embed_model = self._index.service_context.embed_model
+            # Otherwise the index would call the embedding API on the event loop
+            embedding = await run_sync(embed_model.get_query_embedding, question)
+            self._embedding_cache.set(question, embedding)
+        return QueryBundle(question, embedding=embedding)
 
     async def on_feedback(self, feedback: ReportFeedbackRequest) -> None:
         """Called when we receive user feedback such as likes."""
@@ -157,18 +368,107 @@ class LlamaBot(PoeBot):
         """Return the settings for this bot."""
         return SETTINGS
 
-    async def add_documents(self, request: AddDocumentsRequest) -> None:
-        """Add documents."""
-        llama_docs = _to_llama_documents(request.documents)
+    def _prepare_nodes(self, docs: list[Document]) -> tuple[list[Document], list[Node]]:
+        """Parse documents into nodes and embed them. Runs in a worker thread."""
+        llama_docs = _to_llama_documents(docs)
         nodes = self._index.service_context.node_parser.get_nodes_from_documents(
             llama_docs
         )
-        self._index.insert_nodes(nodes)
+        if isinstance(self._index, GPTVectorStoreIndex):
+            # Embed the whole batch here, so that inserting the nodes on the event
+            # loop does not call the embedding API
+            embed_model = self._index.service_context.embed_model
+            with self._embed_lock:
+                for node in nodes:
+                    embed_model.queue_text_for_embeddding(
+                        node.get_doc_id(), node.get_text()
+                    )
+                node_ids, embeddings = embed_model.get_queued_text_embeddings()
+            embeddings_by_id = dict(zip(node_ids, embeddings))
+            for node in nodes:
+                node.embedding = embeddings_by_id[node.get_doc_id()]
+        return docs, nodes
+
+    async def _insert_nodes(self, prepared: tuple[list[Document], list[Node]]) -> None:
+        """Log documents, then insert their nodes, replacing older versions."""
+        docs, nodes = prepared
+        assert self._index_lock is not None
+        async with self._index_lock:
+            await run_sync(self._persistence.log, docs)
+            # Deleting scans the whole index, so keep it off the event loop
+            await run_sync(self._insert_logged_nodes, nodes)
+
+    def _insert_logged_nodes(self, nodes: list[Node]) -> None:
+        doc_ids = {node.ref_doc_id for node in nodes if node.ref_doc_id is not None}
+        with self._index_thread_lock:
+            # Deleting scans the whole index, so only do it for documents we replace
+            for doc_id in doc_ids & self._inserted_doc_ids:
+                self._index.delete(doc_id)
+            self._index.insert_nodes(nodes)
+        self._inserted_doc_ids |= doc_ids
+
+    async def add_documents(self, request: AddDocumentsRequest) -> IngestionJob:
+        """Queue documents for ingestion."""
+        return self._ingestion.submit(request.documents)
 
     async def handle_add_documents(self, request: AddDocumentsRequest) -> JSONResponse:
-        await self.add_documents(request)
-        return JSONResponse({})
+        job = await self.add_documents(request)
+        return JSONResponse(job.dict(), status_code=202)
+
+    async def handle_ingestion_job(self, job_id: str) -> JSONResponse:
+        job = self._ingestion.get_job(job_id)
+        if job is None:
+            return JSONResponse({"detail": "Unknown job"}, status_code=404)
+        return JSONResponse(job.dict())
+
+    async def save_snapshot(self) -> None:
+        """Save the index in a worker thread and drop the logs it contains."""
+        assert self._index_lock is not None
+        async with self._index_lock:
+            await run_sync(self._persistence.save_snapshot, self._save_index)
+        logger.info(f"Saved index to {self._persistence.snapshot_path}")
+
+    def _save_index(self, path: str) -> None:
+        if supports_binary_format(self._index):
+            save_index(self._index, path)
+        else:
+            self._index.save_to_disk(path)
+
+    async def _preload_docstore(self, docstore: LazyDocumentStore) -> None:
+        start = time.perf_counter()
+        try:
+            await run_sync(docstore.ensure_loaded)
+        except Exception:
+            logger.exception("Failed to load the docstore")
+        else:
+            logger.info(f"Loaded the docstore in {time.perf_counter() - start:.2f}s")
+
+    def _needs_snapshot(self) -> bool:
+        return (
+            self._persistence.snapshot_path is None
+            or self._persistence.num_logged_batches > 0
+        )
 
-    def handle_shutdown(self) -> None:
-        """Save index upon shutdown."""
-        self._index.save_to_disk(INDEX_JSON_PATH)
+    async def _save_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL_SECS)
+            if self._needs_snapshot():
+                try:
+                    await self.save_snapshot()
+                except Exception:
+                    logger.exception("Failed to save index")
+
+    async def on_shutdown(self) -> None:
+        """Finish ingestion and stop saving snapshots.
+
+        Documents added since the last snapshot are in the write-ahead log, so the
+        index is only saved here if it has never been saved.
+        """
+        await self._ingestion.stop()
+        for task in (self._snapshot_task, self._preload_task):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        if self._persistence.snapshot_path is None:
+            await self.save_snapshot()
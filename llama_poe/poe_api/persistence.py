@@ -0,0 +1,175 @@
+"""
+Snapshots and a write-ahead log for the index.
+
+Documents are appended to a write-ahead log before they are inserted into the index,
+and the index is saved in the background from time to time. On startup, the latest
+snapshot is loaded and the documents logged after it are inserted again, so nothing
+is lost in a crash and saving does not have to wait for shutdown.
+
+Files next to index_path:
+
+- index_path.manifest: JSON naming the current snapshot and the first log generation
+  that is not in it. Replacing this file is what commits a snapshot.
+- index_path.<generation>: snapshot that contains all logs before that generation,
+  a file or a directory.
+- index_path.wal.<generation>: log of document batches, one JSON line each.
+
+If there is no manifest, index_path itself is used as the snapshot, as before.
+"""
+from __future__ import annotations
+
+import contextlib
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Callable, Iterator
+
+from poe_api.types import Document
+
+logger = logging.getLogger(__name__)
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomically(path: str, write: Callable[[str], None]) -> None:
+    """Call write with a temporary path, then move the result to path.
+
+    write may create either a file or a directory.
+    """
+    directory = os.path.dirname(path) or "."
+    tmp_dir = tempfile.mkdtemp(dir=directory, suffix=".tmp")
+    tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+    try:
+        write(tmp_path)
+        if os.path.isdir(tmp_path):
+            for name in os.listdir(tmp_path):
+                _fsync(os.path.join(tmp_path, name))
+        _fsync(tmp_path)
+        os.replace(tmp_path, path)
+        _fsync(directory)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+class IndexPersistence:
+    def __init__(self, index_path: str) -> None:
+        self.index_path = index_path
+        self.manifest_path = f"{index_path}.manifest"
+        directory = os.path.dirname(index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._snapshot_path: str | None = None
+        # Logs from this generation on are not in the snapshot
+        self._first_generation = 0
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except OSError:
+            if os.path.exists(index_path):
+                self._snapshot_path = index_path
+        else:
+            self._snapshot_path = os.path.join(
+                os.path.dirname(index_path), manifest["snapshot"]
+            )
+            self._first_generation = manifest["wal_generation"]
+        # Append to the newest log
+        self._generation = max([self._first_generation, *self._wal_generations()])
+        # Batches in the log that are not in the snapshot
+        self.num_logged_batches = 0
+
+    @property
+    def snapshot_path(self) -> str | None:
+        """Path of the latest snapshot, or None if there is none."""
+        return self._snapshot_path
+
+    def _wal_path(self, generation: int) -> str:
+        return f"{self.index_path}.wal.{generation}"
+
+    def _wal_generations(self) -> list[int]:
+        generations = []
+        for path in glob.glob(glob.escape(f"{self.index_path}.wal.") + "*"):
+            suffix = path.rpartition(".")[2]
+            if suffix.isdigit():
+                generations.append(int(suffix))
+        return sorted(generations)
+
+    def replay(self) -> Iterator[list[Document]]:
+        """Yield the logged document batches that are not in the snapshot."""
+        for generation in self._wal_generations():
+            if generation < self._first_generation:
+                continue
+            with open(self._wal_path(generation), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash while appending can leave a partial last line
+                        logger.warning(f"Skipping corrupt line in log {generation}")
+                        continue
+                    self.num_logged_batches += 1
+                    yield [Document.parse_obj(doc) for doc in record["documents"]]
+
+    def log(self, documents: list[Document]) -> None:
+        """Durably append a batch of documents to the log."""
+        line = json.dumps({"documents": [doc.dict() for doc in documents]})
+        with self._lock:
+            with open(self._wal_path(self._generation), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.num_logged_batches += 1
+
+    def save_snapshot(self, save: Callable[[str], None]) -> None:
+        """Save a snapshot with save(path) and drop the logs it contains.
+
+        save must create a file or a directory at path.
+
+        Nothing may be inserted into the index or logged while this runs.
+        """
+        with self._lock:
+            generation = self._generation
+            # Batches logged from now on are not in this snapshot
+            self._generation += 1
+        snapshot_path = f"{self.index_path}.{generation + 1}"
+        _write_atomically(snapshot_path, save)
+        manifest = {
+            "snapshot": os.path.basename(snapshot_path),
+            "wal_generation": generation + 1,
+        }
+
+        def write_manifest(path: str) -> None:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+
+        _write_atomically(self.manifest_path, write_manifest)
+        old_snapshot_path = self._snapshot_path
+        self._snapshot_path = snapshot_path
+        self._first_generation = generation + 1
+        self.num_logged_batches = 0
+        # The new snapshot is committed, so older files are no longer needed. The
+        # file at index_path is left alone, since it was not written by us.
+        if old_snapshot_path is not None and old_snapshot_path != self.index_path:
+            _remove(old_snapshot_path)
+        for old_generation in self._wal_generations():
+            if old_generation <= generation:
+                with contextlib.suppress(OSError):
+                    os.remove(self._wal_path(old_generation))
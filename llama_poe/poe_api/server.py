@@ -1,6 +1,7 @@
 import copy
 import logging
 import os
+import time
 from typing import Any, Dict
 
 import uvicorn.config
@@ -10,9 +11,10 @@ from fastapi.responses import HTMLResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from poe_api import llama_handler
 from poe_api.types import AddDocumentsRequest
-from poe_api.utils import LoggingMiddleware
 from sse_starlette.sse import EventSourceResponse
 
+from fastapi_poe.concurrency import LoopLagMonitor
+from fastapi_poe.middleware import LoggingMiddleware
 from fastapi_poe.types import (
     QueryRequest,
     ReportErrorRequest,
@@ -26,6 +28,8 @@ logger = logging.getLogger("uvicorn.default")
 http_bearer = HTTPBearer()
 BEARER_TOKEN = os.environ.get("POE_API_KEY")
 assert BEARER_TOKEN is not None
+LOG_SAMPLE_RATE = float(os.environ.get("LLAMA_LOG_SAMPLE_RATE", "1.0"))
+LOOP_LAG_THRESHOLD_SECS = float(os.environ.get("LLAMA_LOOP_LAG_THRESHOLD_SECS", "0.1"))
 
 
 def exception_handler(request: Request, ex: HTTPException):
@@ -47,10 +51,13 @@ def auth_user(
 app = FastAPI()
 app.add_exception_handler(RequestValidationError, exception_handler)
 
-# Uncomment this line to print out request and response
-app.add_middleware(LoggingMiddleware)
+# Log a sample of requests and responses
+app.add_middleware(LoggingMiddleware, sample_rate=LOG_SAMPLE_RATE)
 logger.info("Starting")
 
+# Warn when a handler blocks the event loop, stalling every other stream
+lag_monitor = LoopLagMonitor(threshold_secs=LOOP_LAG_THRESHOLD_SECS)
+
 log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
 log_config["formatters"]["default"]["fmt"] = "%(asctime)s - %(levelname)s - %(message)s"
 
@@ -91,15 +98,25 @@ async def add_document(
     return await handler.handle_add_documents(request)
 
 
+@app.get("/add_document/{job_id}")
+async def add_document_status(job_id: str, dict=Depends(auth_user)) -> Response:
+    return await handler.handle_ingestion_job(job_id)
+
+
 @app.on_event("startup")
 async def startup():
     global handler
+    start = time.perf_counter()
     handler = llama_handler.LlamaBot()
+    await handler.handle_startup()
+    lag_monitor.start()
+    logger.info(f"Ready to serve requests in {time.perf_counter() - start:.2f}s")
 
 
 @app.on_event("shutdown")
-def shutdown():
-    handler.handle_shutdown()
+async def shutdown():
+    await lag_monitor.stop()
+    await handler.handle_shutdown()
 
 
 def start():
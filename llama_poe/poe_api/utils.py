@@ -1,40 +0,0 @@
-import json
-import logging
-
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-
-logger = logging.getLogger("uvicorn.default")
-
-
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def set_body(self, request: Request):
-        receive_ = await request._receive()
-
-        async def receive():
-            return receive_
-
-        request._receive = receive
-
-    async def dispatch(self, request: Request, call_next):
-        logger.info(f"Request: {request.method} {request.url}")
-        try:
-            # Per https://github.com/tiangolo/fastapi/issues/394#issuecomment-927272627
-            # to avoid blocking.
-            await self.set_body(request)
-            body = await request.json()
-            logger.debug(f"Request body: {json.dumps(body)}")
-        except json.JSONDecodeError:
-            logger.error("Request body: Unable to parse JSON")
-
-        response = await call_next(request)
-
-        logger.info(f"Response status: {response.status_code}")
-        try:
-            if hasattr(response, "body"):
-                body = json.loads(response.body.decode())
-                logger.debug(f"Response body: {json.dumps(body)}")
-        except json.JSONDecodeError:
-            logger.error("Response body: Unable to parse JSON")
-
-        return response
@@ -0,0 +1,374 @@
+"""
+Vector store that keeps all embeddings in one NumPy matrix.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Sequence
+
+import numpy as np
+from llama_index.vector_stores.types import (
+    NodeEmbeddingResult,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from fastapi_poe.cache import LRUCache
+
+# Supported types for the stored embeddings
+DTYPES = ("float32", "float16", "int8")
+
+# Quantized rows are converted to float32 this many at a time when querying
+_QUERY_BLOCK_ROWS = 256
+
+
+def _quantize(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Quantize each row to int8, with one scale per row."""
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1
+    rows = np.rint(embeddings / scales[:, np.newaxis]).astype(np.int8)
+    return rows, scales.astype(np.float32)
+
+
+def _copy_result(result: VectorStoreQueryResult) -> VectorStoreQueryResult:
+    # Callers get copies, so that cached lists are never changed
+    return VectorStoreQueryResult(
+        similarities=list(result.similarities or []), ids=list(result.ids or [])
+    )
+
+
+class NumpyVectorStore:
+    """Vector store with the embeddings in the rows of one matrix.
+
+    Unlike SimpleVectorStore, which keeps a list of floats per node, the matrix can
+    be memory-mapped from a file, so that loading it does not read it. A read-only
+    matrix is copied into memory the first time the store is changed. Rows are
+    appended into spare capacity, which grows geometrically.
+
+    Queries use cosine similarity, like SimpleVectorStore, and return the top k with
+    np.argpartition rather than by sorting all similarities. With dtype "float16",
+    embeddings take half the memory, but queries are several times slower, because
+    NumPy converts half floats slowly. With "int8", they take a quarter, and each row
+    is scaled to the int8 range separately, which changes similarities by about 1%.
+
+    Queries and changes hold a lock, so the store can be used from worker threads.
+    """
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+
+    def __init__(
+        self,
+        embeddings: np.ndarray | None = None,
+        ids: Sequence[str] = (),
+        doc_ids: Sequence[str] = (),
+        *,
+        dtype: str | None = None,
+        scales: np.ndarray | None = None,
+        norms: np.ndarray | None = None,
+    ) -> None:
+        """Create a store with the given rows.
+
+        embeddings are stored as they are, so with dtype "int8" they must already be
+        quantized and scales must be given. norms are the norms of the original
+        embeddings; they are computed on the first query if not given.
+        """
+        if embeddings is not None and dtype is None:
+            dtype = embeddings.dtype.name
+        dtype = dtype or "float32"
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        if len(ids) != len(doc_ids):
+            raise ValueError("ids and doc_ids must have the same length")
+        if embeddings is not None and len(embeddings) != len(ids):
+            raise ValueError("embeddings must have one row per id")
+        if dtype == "int8" and ids and scales is None:
+            raise ValueError("scales are required for int8 embeddings")
+        self.dtype = dtype
+        self._size = len(ids)
+        # The first _size rows are in use, the rest is spare capacity
+        self._rows = embeddings if ids else None
+        self._scales = scales if dtype == "int8" and ids else None
+        self._norms = norms if ids else None
+        self._ids = list(ids)
+        self._doc_ids = list(doc_ids)
+        self._id_to_row = {text_id: row for row, text_id in enumerate(self._ids)}
+        self._lock = threading.Lock()
+        # If set, query results by query embedding and top k; cleared on changes
+        self.query_cache: LRUCache[tuple[bytes, int], VectorStoreQueryResult] | None
+        self.query_cache = None
+
+    @classmethod
+    def from_dict(
+        cls, config_dict: dict[str, Any], dtype: str = "float32"
+    ) -> NumpyVectorStore:
+        """Create a store from the config_dict of a SimpleVectorStore."""
+        data = config_dict["simple_vector_store_data_dict"]
+        ids = list(data["embedding_dict"])
+        store = cls(dtype=dtype)
+        if ids:
+            embeddings = np.array(
+                [data["embedding_dict"][text_id] for text_id in ids], dtype=np.float32
+            )
+            doc_ids = [data["text_id_to_doc_id"][text_id] for text_id in ids]
+            store._append(ids, doc_ids, embeddings)
+        return store
+
+    def astype(self, dtype: str) -> NumpyVectorStore:
+        """Return a copy of the store with embeddings stored as dtype."""
+        store = NumpyVectorStore(dtype=dtype)
+        if self._size:
+            embeddings = self._dequantize(self.embeddings, self.scales)
+            store._append(self._ids, self._doc_ids, embeddings)
+        return store
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def config_dict(self) -> dict:
+        """Get the config dict of an equivalent SimpleVectorStore."""
+        embeddings = self._dequantize(self.embeddings, self.scales).tolist()
+        return {
+            "simple_vector_store_data_dict": {
+                "embedding_dict": dict(zip(self._ids, embeddings)),
+                "text_id_to_doc_id": dict(zip(self._ids, self._doc_ids)),
+            }
+        }
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Stored matrix with the embedding of ids[i] in row i."""
+        if self._rows is None:
+            return np.zeros((0, 0), dtype=self.dtype)
+        return self._rows[: self._size]
+
+    @property
+    def scales(self) -> np.ndarray | None:
+        """Scale of each row of embeddings, if the dtype is int8."""
+        if self._scales is None:
+            return None
+        return self._scales[: self._size]
+
+    @property
+    def norms(self) -> np.ndarray:
+        """Norm of each embedding."""
+        if self._norms is None:
+            # Computed lazily, so that loading a memory-mapped matrix does not read it
+            self._norms = self._compute_norms(self.embeddings, self.scales)
+        return self._norms[: self._size]
+
+    @property
+    def ids(self) -> list[str]:
+        return self._ids
+
+    @property
+    def doc_ids(self) -> list[str]:
+        return self._doc_ids
+
+    def get(self, text_id: str) -> list[float]:
+        """Get embedding."""
+        rows = [self._id_to_row[text_id]]
+        scales = None if self._scales is None else self._scales[rows]
+        return self._dequantize(self.embeddings[rows], scales)[0].tolist()
+
+    def add(self, embedding_results: list[NodeEmbeddingResult]) -> list[str]:
+        """Add embedding_results to the store, replacing any with the same id."""
+        with self._lock:
+            return self._add(embedding_results)
+
+    def delete(self, doc_id: str, **delete_kwargs: Any) -> None:
+        """Delete the embeddings of a document."""
+        with self._lock:
+            self._delete(doc_id)
+
+    def query(self, query: VectorStoreQuery) -> VectorStoreQueryResult:
+        """Get the ids of the most similar embeddings."""
+        with self._lock:
+            return self._query(query)
+
+    def _add(self, embedding_results: list[NodeEmbeddingResult]) -> list[str]:
+        if not embedding_results:
+            return []
+        self._clear_query_cache()
+        embeddings = np.array(
+            [result.embedding for result in embedding_results], dtype=np.float32
+        )
+        # Position in embedding_results of the last result for each new id
+        new_positions: dict[str, int] = {}
+        for position, result in enumerate(embedding_results):
+            row = self._id_to_row.get(result.id)
+            if row is None:
+                new_positions[result.id] = position
+            else:
+                self._set_row(row, embeddings[position])
+                self._doc_ids[row] = result.doc_id
+        if new_positions:
+            positions = list(new_positions.values())
+            self._append(
+                list(new_positions),
+                [embedding_results[position].doc_id for position in positions],
+                embeddings[positions],
+            )
+        return [result.id for result in embedding_results]
+
+    def _delete(self, doc_id: str) -> None:
+        keep = [row for row, doc_id_ in enumerate(self._doc_ids) if doc_id_ != doc_id]
+        if len(keep) == self._size:
+            return
+        self._clear_query_cache()
+        self._make_writable()
+        assert self._rows is not None and self._norms is not None
+        # Fancy indexing copies the rows, so they can be moved down in place
+        self._rows[: len(keep)] = self._rows[keep]
+        if self._scales is not None:
+            self._scales[: len(keep)] = self._scales[keep]
+        self._norms[: len(keep)] = self._norms[keep]
+        self._size = len(keep)
+        self._ids = [self._ids[row] for row in keep]
+        self._doc_ids = [self._doc_ids[row] for row in keep]
+        self._id_to_row = {text_id: row for row, text_id in enumerate(self._ids)}
+
+    def _query(self, query: VectorStoreQuery) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        top_k = min(query.similarity_top_k, self._size)
+        if top_k <= 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        cache_key = (query_embedding.tobytes(), top_k)
+        if self.query_cache is not None:
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                return _copy_result(cached)
+        similarities = self._dot(query_embedding)
+        norms = self.norms * np.linalg.norm(query_embedding)
+        # Zero vectors are not similar to anything
+        np.divide(similarities, norms, out=similarities, where=norms != 0)
+        similarities[norms == 0] = 0
+        if top_k < self._size:
+            top_rows = np.argpartition(-similarities, top_k - 1)[:top_k]
+        else:
+            top_rows = np.arange(self._size)
+        # Only the top k are sorted, ties in order of insertion like sorted()
+        top_rows = top_rows[np.lexsort((top_rows, -similarities[top_rows]))]
+        result = VectorStoreQueryResult(
+            similarities=similarities[top_rows].tolist(),
+            ids=[self._ids[row] for row in top_rows],
+        )
+        if self.query_cache is not None:
+            self.query_cache.set(cache_key, result)
+            return _copy_result(result)
+        return result
+
+    def _clear_query_cache(self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def _dot(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Dot products of the original embeddings with query_embedding."""
+        rows = self.embeddings
+        if self.dtype == "float32":
+            return rows @ query_embedding
+        # NumPy has no fast matrix product for float16 or int8, so convert in blocks
+        products = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, _QUERY_BLOCK_ROWS):
+            stop = start + _QUERY_BLOCK_ROWS
+            products[start:stop] = rows[start:stop].astype(np.float32) @ query_embedding
+        if self._scales is not None:
+            products *= self.scales
+        return products
+
+    @staticmethod
+    def _dequantize(rows: np.ndarray, scales: np.ndarray | None) -> np.ndarray:
+        embeddings = rows.astype(np.float32)
+        if scales is not None:
+            embeddings *= scales[:, np.newaxis]
+        return embeddings
+
+    def _encode(self, embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        if self.dtype == "int8":
+            return _quantize(embeddings)
+        return embeddings.astype(self.dtype), None
+
+    @staticmethod
+    def _compute_norms(rows: np.ndarray, scales: np.ndarray | None) -> np.ndarray:
+        norms = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _QUERY_BLOCK_ROWS):
+            stop = start + _QUERY_BLOCK_ROWS
+            norms[start:stop] = np.linalg.norm(
+                rows[start:stop].astype(np.float32), axis=1
+            )
+        if scales is not None:
+            norms *= scales
+        return norms
+
+    def _set_row(self, row: int, embedding: np.ndarray) -> None:
+        self._make_writable()
+        assert self._rows is not None and self._norms is not None
+        encoded, scales = self._encode(embedding[np.newaxis, :])
+        self._rows[row] = encoded[0]
+        if scales is not None:
+            assert self._scales is not None
+            self._scales[row] = scales[0]
+        self._norms[row] = np.linalg.norm(embedding)
+
+    def _append(
+        self, ids: list[str], doc_ids: list[str], embeddings: np.ndarray
+    ) -> None:
+        encoded, scales = self._encode(embeddings)
+        start = self._size
+        stop = start + len(ids)
+        self._reserve(stop, embeddings.shape[1])
+        assert self._rows is not None and self._norms is not None
+        self._rows[start:stop] = encoded
+        if scales is not None:
+            assert self._scales is not None
+            self._scales[start:stop] = scales
+        self._norms[start:stop] = np.linalg.norm(embeddings, axis=1)
+        for text_id, doc_id in zip(ids, doc_ids):
+            self._id_to_row[text_id] = len(self._ids)
+            self._ids.append(text_id)
+            self._doc_ids.append(doc_id)
+        self._size = stop
+
+    def _reserve(self, capacity: int, dim: int) -> None:
+        """Make room for capacity rows, in writable arrays."""
+        if self._rows is not None and self._rows.shape[1] != dim:
+            raise ValueError(
+                f"Embedding has {dim} dimensions, expected {self._rows.shape[1]}"
+            )
+        current = 0 if self._rows is None else len(self._rows)
+        if capacity <= current and self._is_writable():
+            return
+        capacity = max(capacity, 2 * current, 16)
+        self._resize(capacity, dim)
+
+    def _make_writable(self) -> None:
+        if self._rows is not None and not self._is_writable():
+            self._resize(len(self._rows), self._rows.shape[1])
+
+    def _is_writable(self) -> bool:
+        return (
+            self._rows is not None
+            and self._rows.flags.writeable
+            and self._norms is not None
+            and len(self._norms) == len(self._rows)
+            and (self._scales is None or self._scales.flags.writeable)
+        )
+
+    def _resize(self, capacity: int, dim: int) -> None:
+        rows = np.zeros((capacity, dim), dtype=self.dtype)
+        norms = np.zeros(capacity, dtype=np.float32)
+        scales = np.ones(capacity, dtype=np.float32)
+        if self._size:
+            rows[: self._size] = self.embeddings
+            norms[: self._size] = self.norms
+            if self._scales is not None:
+                scales[: self._size] = self.scales
+        if self.dtype == "int8":
+            self._scales = scales
+        self._rows = rows
+        self._norms = norms
@@ -1,4 +1,12 @@
-__all__ = ["PoeServer", "AsyncBotClient", "ServerContext"]
+__all__ = [
+    "PoeServer",
+    "AsyncBotClient",
+    "ServerContext",
+    "LoadGenerator",
+    "LoadReport",
+    "RequestResult",
+]
 
 from .async_bot_client import AsyncBotClient
+from .load_test import LoadGenerator, LoadReport, RequestResult
 from .poe_server import PoeServer, ServerContext
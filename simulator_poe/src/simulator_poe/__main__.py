@@ -1,8 +1,70 @@
+import argparse
+import asyncio
 import os
 
 from simulator_poe import PoeServer
+from simulator_poe.load_test import DEFAULT_SCRIPT, LoadGenerator, load_scripts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python3 -m simulator_poe", description="Poe server simulator"
+    )
+    parser.add_argument(
+        "--bot-server",
+        default=os.environ.get("BOT_SERVER", "127.0.0.1:8080"),
+        help="address of the bot server (default: $BOT_SERVER or 127.0.0.1:8080)",
+    )
+    parser.add_argument(
+        "--load-test",
+        action="store_true",
+        help="run a headless load test instead of the interactive simulator",
+    )
+    load_test = parser.add_argument_group("load test")
+    load_test.add_argument(
+        "--script",
+        help="file with one conversation per line, as a JSON array of user messages",
+    )
+    load_test.add_argument(
+        "--concurrency", type=int, default=1, help="number of concurrent conversations"
+    )
+    load_test.add_argument(
+        "--rps", type=float, help="target requests per second (default: unlimited)"
+    )
+    load_test.add_argument(
+        "--duration", type=float, help="stop after this many seconds"
+    )
+    load_test.add_argument(
+        "--num-requests", type=int, help="stop after this many requests"
+    )
+    load_test.add_argument(
+        "--timeout", type=float, default=60.0, help="timeout of each request in seconds"
+    )
+    args = parser.parse_args()
+    if args.load_test and args.duration is None and args.num_requests is None:
+        parser.error("--load-test requires --duration or --num-requests")
+    return args
+
+
+def run_load_test(args):
+    scripts = load_scripts(args.script) if args.script else [DEFAULT_SCRIPT]
+    generator = LoadGenerator(
+        args.bot_server,
+        scripts,
+        concurrency=args.concurrency,
+        rps=args.rps,
+        duration=args.duration,
+        num_requests=args.num_requests,
+        timeout=args.timeout,
+    )
+    report = asyncio.run(generator.run())
+    print(report.format())
+
 
 if __name__ == "__main__":
-    bot_server = os.environ.get("BOT_SERVER", "127.0.0.1:8080")
-    server = PoeServer(bot_server)
-    server.start()
+    args = parse_args()
+    if args.load_test:
+        run_load_test(args)
+    else:
+        server = PoeServer(args.bot_server)
+        server.start()
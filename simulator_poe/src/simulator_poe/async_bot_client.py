@@ -12,11 +12,11 @@ _API_VERSION = "1.0"
 
 
 class AsyncBotClient:
-    def __init__(self, end_point):
+    def __init__(self, end_point, conversation_id="c-1234567", session=None):
         self.end_point = end_point
-        self.session = None
-        self.headers = {"Authorization": f"bearer {os.environ.get('POE_API_KEY')}"}
-        self.conversation_id = "c-1234567"
+        self.session = session
+        self.headers = {"Authorization": f"Bearer {os.environ.get('POE_API_KEY')}"}
+        self.conversation_id = conversation_id
         self.msg_id = 0
 
     def build_single_Message(self, role, msg):
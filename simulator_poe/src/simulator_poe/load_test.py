@@ -0,0 +1,266 @@
+"""Headless load generator for bot servers.
+
+LoadGenerator runs a number of conversations concurrently against a bot server,
+replaying scripted user messages at a target rate, and reports the time to first
+token, inter-token latency and total latency of the replies, as well as the error
+rate.
+"""
+import asyncio
+import dataclasses
+import itertools
+import json
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from aiohttp import ClientSession, TCPConnector
+
+from simulator_poe.async_bot_client import AsyncBotClient
+from simulator_poe.poe_server import ServerContext
+
+DEFAULT_SCRIPT = ["Hello!"]
+
+_PERCENTILES = (50, 90, 99)
+
+
+def load_scripts(path: str) -> List[List[str]]:
+    """Load conversation scripts from a file.
+
+    Each non-empty line holds one conversation: a JSON array with the user messages
+    to send in order, or a JSON string for a conversation of a single message.
+    """
+    scripts = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            script = json.loads(line)
+            if isinstance(script, str):
+                script = [script]
+            if (
+                not isinstance(script, list)
+                or not script
+                or not all(isinstance(msg, str) for msg in script)
+            ):
+                raise ValueError(
+                    f"{path}:{line_number}: expected a list of messages, got {line}"
+                )
+            scripts.append(script)
+    if not scripts:
+        raise ValueError(f"{path} does not contain any conversations")
+    return scripts
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """The p-th percentile of values, by the nearest-rank method."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+@dataclasses.dataclass
+class RequestResult:
+    """Timings of one request to the bot server, in seconds."""
+
+    start: float
+    total: float
+    # None if the bot did not send any text
+    ttft: Optional[float] = None
+    inter_token_latencies: List[float] = dataclasses.field(default_factory=list)
+    error: Optional[str] = None
+
+
+@dataclasses.dataclass
+class LoadReport:
+    """The results of a load test."""
+
+    results: List[RequestResult]
+    duration: float
+
+    @property
+    def errors(self) -> List[RequestResult]:
+        return [result for result in self.results if result.error is not None]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.results:
+            return 0.0
+        return len(self.errors) / len(self.results)
+
+    def latency_stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Percentiles and maximum of each latency, over the successful requests."""
+        ok = [result for result in self.results if result.error is None]
+        samples = {
+            "ttft": [result.ttft for result in ok if result.ttft is not None],
+            "inter_token": [
+                gap for result in ok for gap in result.inter_token_latencies
+            ],
+            "total": [result.total for result in ok],
+        }
+        stats = {}
+        for name, values in samples.items():
+            stats[name] = {f"p{p}": percentile(values, p) for p in _PERCENTILES}
+            stats[name]["max"] = max(values) if values else None
+        return stats
+
+    def format(self) -> str:
+        rps = len(self.results) / self.duration if self.duration else 0.0
+        lines = [
+            f"Requests: {len(self.results)} in {self.duration:.1f}s ({rps:.2f}/s)",
+            f"Errors: {len(self.errors)} ({self.error_rate:.1%})",
+            "",
+            "Latency (ms)  "
+            + "".join(f"{'p' + str(p):>10}" for p in _PERCENTILES)
+            + f"{'max':>10}",
+        ]
+        for name, stats in self.latency_stats().items():
+            cells = "".join(
+                f"{'-' if value is None else format(value * 1000, '.1f'):>10}"
+                for value in stats.values()
+            )
+            lines.append(f"{name:<14}{cells}")
+        error_counts: Dict[str, int] = {}
+        for result in self.errors:
+            error_counts[result.error] = error_counts.get(result.error, 0) + 1
+        if error_counts:
+            lines.append("")
+            lines.append("Errors by type:")
+            for error, count in sorted(error_counts.items(), key=lambda item: -item[1]):
+                lines.append(f"  {count:>6}  {error}")
+        return "\n".join(lines)
+
+
+class LoadGenerator:
+    """Runs scripted conversations concurrently against a bot server.
+
+    concurrency conversations run at the same time. Each one replays a script from
+    scripts, sending a message once the reply to the previous one is done, and then
+    starts over with the next script under a new conversation ID. If rps is set,
+    requests across all conversations are paced to at most that many per second.
+    The test stops after duration seconds or num_requests requests, whichever comes
+    first; at least one of them must be set.
+    """
+
+    def __init__(
+        self,
+        bot_server: str,
+        scripts: Iterable[List[str]] = (DEFAULT_SCRIPT,),
+        *,
+        concurrency: int = 1,
+        rps: Optional[float] = None,
+        duration: Optional[float] = None,
+        num_requests: Optional[int] = None,
+        timeout: float = 60.0,
+    ):
+        if duration is None and num_requests is None:
+            raise ValueError("Either duration or num_requests must be set")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if rps is not None and rps <= 0:
+            raise ValueError("rps must be positive")
+        self.bot_server = bot_server
+        self.scripts = list(scripts)
+        if not self.scripts:
+            raise ValueError("At least one script is required")
+        self.concurrency = concurrency
+        self.rps = rps
+        self.duration = duration
+        self.num_requests = num_requests
+        self.timeout = timeout
+
+    async def run(self) -> LoadReport:
+        self._results: List[RequestResult] = []
+        self._sent = 0
+        self._scripts = itertools.cycle(self.scripts)
+        self._conversation_ids = itertools.count()
+        self._start = time.perf_counter()
+        self._next_slot = self._start
+        self._deadline = None if self.duration is None else self._start + self.duration
+        async with ClientSession(
+            connector=TCPConnector(limit=self.concurrency)
+        ) as session:
+            await asyncio.gather(
+                *(self._run_conversations(session) for _ in range(self.concurrency))
+            )
+        return LoadReport(self._results, time.perf_counter() - self._start)
+
+    def _is_done(self) -> bool:
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            return True
+        return self.num_requests is not None and self._sent >= self.num_requests
+
+    async def _wait_for_slot(self) -> None:
+        if self.rps is None:
+            return
+        # The event loop is single-threaded, so reserving a slot needs no lock
+        now = time.perf_counter()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1 / self.rps
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _run_conversations(self, session: ClientSession) -> None:
+        while not self._is_done():
+            client = AsyncBotClient(
+                self.bot_server,
+                conversation_id=f"c-load-{next(self._conversation_ids)}",
+                session=session,
+            )
+            context = ServerContext(messages=[])
+            for msg in next(self._scripts):
+                await self._wait_for_slot()
+                if self._is_done():
+                    return
+                self._sent += 1
+                result = await self._send_message(client, msg, context)
+                self._results.append(result)
+                if result.error is not None:
+                    # The conversation has no reply to continue from
+                    break
+
+    async def _send_message(
+        self, client: AsyncBotClient, msg: str, context: ServerContext
+    ) -> RequestResult:
+        result = RequestResult(start=time.perf_counter() - self._start, total=0.0)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                self._stream_reply(client, msg, context, result, start), self.timeout
+            )
+        except asyncio.TimeoutError:
+            result.error = f"Timed out after {self.timeout}s"
+        except Exception as e:
+            result.error = repr(e)
+        result.total = time.perf_counter() - start
+        return result
+
+    async def _stream_reply(
+        self,
+        client: AsyncBotClient,
+        msg: str,
+        context: ServerContext,
+        result: RequestResult,
+        start: float,
+    ) -> None:
+        content = ""
+        last_token = None
+        async for event in client.stream_request(msg, context):
+            if event.message in ("text", "replace_response"):
+                now = time.perf_counter()
+                if last_token is None:
+                    result.ttft = now - start
+                else:
+                    result.inter_token_latencies.append(now - last_token)
+                last_token = now
+                text = json.loads(event.data)["text"]
+                content = content + text if event.message == "text" else text
+            elif event.message == "error":
+                result.error = f"Error event: {event.data}"
+            elif event.message == "done":
+                context.messages.append(client.build_single_Message("bot", content))
+                return
+        if result.error is None:
+            result.error = "Stream ended without a done event"